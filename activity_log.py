@@ -0,0 +1,199 @@
+import asyncio
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# One row per one-off data migration that has run
+MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name VARCHAR(64) PRIMARY KEY,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# Old user_activity rows in activity_log's shape; 'points_added_5' becomes ('points_added', 5)
+LEGACY_ACTIVITY = """
+    SELECT user_id, COALESCE(guild_id, 0) AS guild_id,
+           IF(activity_type LIKE 'points\\_added\\_%', 'points_added', activity_type) AS activity_type,
+           IF(activity_type LIKE 'points\\_added\\_%',
+              CAST(SUBSTRING(activity_type, 14) AS SIGNED), NULL) AS amount,
+           timestamp AS created_at
+    FROM user_activity
+"""
+
+ACTIVITY_DAILY_TABLE = """
+    CREATE TABLE IF NOT EXISTS activity_daily (
+        day DATE NOT NULL,
+        guild_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        activity_type VARCHAR(32) NOT NULL,
+        events INT NOT NULL DEFAULT 0,
+        amount BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, day, user_id, activity_type),
+        INDEX idx_user_day (user_id, day)
+    )
+"""
+
+
+def partition_name(day):
+    return f"p{day:%Y%m%d}"
+
+
+def partition_clause(day):
+    """Partition holding every row timestamped on `day` (UTC)"""
+    return f"PARTITION {partition_name(day)} VALUES LESS THAN ('{day + datetime.timedelta(days=1)}')"
+
+
+def utc_today():
+    return datetime.datetime.now(datetime.timezone.utc).date()
+
+
+class ActivityLog:
+    """Append-only activity log split into one partition per UTC day.
+
+    Rows are written in batches by the write-behind buffer, together with
+    upserts into the activity_daily rollup. Retention drops whole partitions
+    instead of deleting rows, and history reads come from the rollup.
+    """
+
+    def __init__(self, db, retention_days=90, days_ahead=7):
+        self.db = db
+        self.retention_days = retention_days
+        self.days_ahead = days_ahead
+        self._task = None
+
+    def _create_log_table(self):
+        today = utc_today()
+        return f"""
+            CREATE TABLE IF NOT EXISTS activity_log (
+                id BIGINT NOT NULL AUTO_INCREMENT,
+                user_id BIGINT NOT NULL,
+                guild_id BIGINT NOT NULL,
+                activity_type VARCHAR(32) NOT NULL,
+                amount INT NULL,
+                created_at DATETIME NOT NULL,
+                PRIMARY KEY (id, created_at),
+                INDEX idx_guild_time (guild_id, created_at),
+                INDEX idx_user_time (user_id, created_at)
+            )
+            PARTITION BY RANGE COLUMNS (created_at) (
+                PARTITION p_history VALUES LESS THAN ('{today}'),
+                PARTITION p_future VALUES LESS THAN (MAXVALUE)
+            )
+        """
+
+    async def start(self, maintain=True):
+        """Create the tables, migrate legacy rows, then maintain partitions daily.
+
+        With several shard processes only one should pass maintain=True.
+        """
+        await self.db.update(self._create_log_table())
+        await self.db.update(ACTIVITY_DAILY_TABLE)
+        await self.db.update(MIGRATIONS_TABLE)
+        if not maintain:
+            return
+        await self.migrate_legacy()
+        await self.maintain()
+        self._task = asyncio.create_task(self._maintain_daily())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _maintain_daily(self):
+        while True:
+            await asyncio.sleep(24 * 60 * 60)
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.error(f"Activity log maintenance failed: {e}")
+
+    async def partitions(self):
+        """Return [(name, upper_bound_date or None for MAXVALUE)] in order"""
+        rows = await self.db.query(
+            """SELECT partition_name AS name, partition_description AS bound
+               FROM information_schema.partitions
+               WHERE table_schema = DATABASE() AND table_name = 'activity_log'
+               ORDER BY partition_ordinal_position"""
+        ) or []
+        result = []
+        for row in rows:
+            bound = row['bound']
+            if bound is None or bound == 'MAXVALUE':
+                result.append((row['name'], None))
+            else:
+                result.append((row['name'], datetime.date.fromisoformat(bound.strip("'")[:10])))
+        return result
+
+    async def maintain(self):
+        await self.add_partitions()
+        await self.prune()
+
+    async def add_partitions(self):
+        """Split p_future so every day up to days_ahead has its own partition"""
+        bounds = [bound for _, bound in await self.partitions() if bound is not None]
+        if not bounds:
+            return
+        first_missing = max(bounds)
+        last_day = utc_today() + datetime.timedelta(days=self.days_ahead)
+        days = []
+        day = first_missing
+        while day <= last_day:
+            days.append(day)
+            day += datetime.timedelta(days=1)
+        if not days:
+            return
+        clauses = ",\n".join([partition_clause(day) for day in days] +
+                             ["PARTITION p_future VALUES LESS THAN (MAXVALUE)"])
+        await self.db.update(f"ALTER TABLE activity_log REORGANIZE PARTITION p_future INTO ({clauses})")
+        logger.info(f"Added {len(days)} activity_log partitions through {last_day}")
+
+    async def prune(self):
+        """Drop partitions that only hold rows older than retention_days"""
+        cutoff = utc_today() - datetime.timedelta(days=self.retention_days)
+        expired = [name for name, bound in await self.partitions() if bound is not None and bound <= cutoff]
+        if not expired:
+            return
+        await self.db.update(f"ALTER TABLE activity_log DROP PARTITION {', '.join(expired)}")
+        logger.info(f"Dropped {len(expired)} expired activity_log partitions")
+
+    async def migrate_legacy(self):
+        """Copy the old string-encoded user_activity rows over, once.
+
+        The marker row, the copy and the rollup commit in one transaction, so
+        a crash part way leaves nothing behind and the next start redoes it.
+        """
+        if await self.db.query("SELECT 1 FROM schema_migrations WHERE name = 'legacy_activity'") != []:
+            return  # done already, or the check failed and the next start will tell
+        copied = (await self.db.query(f"SELECT COUNT(*) AS count FROM ({LEGACY_ACTIVITY}) AS legacy") or
+                  [{'count': 0}])[0]['count']
+        # The rollup is built from user_activity itself: other shard processes
+        # may already be writing live rows into activity_log
+        migrated = await self.db.transaction([
+            ("INSERT INTO schema_migrations (name) VALUES (%s)", [('legacy_activity',)]),
+            (f"""INSERT INTO activity_log (user_id, guild_id, activity_type, amount, created_at)
+                 SELECT user_id, guild_id, activity_type, amount, created_at FROM ({LEGACY_ACTIVITY}) AS legacy""",
+             [()]),
+            # No VALUES() here: executemany would try to rewrite it as a multi-row INSERT
+            (f"""INSERT INTO activity_daily (day, guild_id, user_id, activity_type, events, amount)
+                 SELECT * FROM (
+                     SELECT DATE(created_at) AS day, guild_id, user_id, activity_type,
+                            COUNT(*) AS legacy_events, COALESCE(SUM(amount), 0) AS legacy_amount
+                     FROM ({LEGACY_ACTIVITY}) AS legacy
+                     GROUP BY DATE(created_at), guild_id, user_id, activity_type
+                 ) AS daily
+                 ON DUPLICATE KEY UPDATE
+                 events = events + legacy_events,
+                 amount = amount + legacy_amount""",
+             [()]),
+        ])
+        if migrated:
+            logger.info(f"Migrated {copied} rows from user_activity into activity_log")
+        else:
+            logger.error("Migrating user_activity into activity_log failed; it will be retried on the next start")
+
+    async def history(self, guild_id, user_id, days=30):
+        """Per-day totals for one member from the rollup table, newest first"""
+        since = utc_today() - datetime.timedelta(days=days - 1)
+        return await self.db.prepared_query('activity_history', (guild_id, user_id, since)) or []
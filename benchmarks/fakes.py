@@ -0,0 +1,85 @@
+"""Minimal stand-ins for the discord.py objects the handlers touch.
+
+Only the attributes and coroutines the bot's commands and events actually
+use are provided; responses are recorded instead of sent.
+"""
+
+
+class FakeMember:
+    def __init__(self, user_id, name, display_name=None, guild=None, bot=False):
+        self.id = user_id
+        self.name = name
+        self.display_name = display_name or name
+        self.guild = guild
+        self.bot = bot
+        self.avatar = None
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, guild_id, name, members=()):
+        self.id = guild_id
+        self.name = name
+        self.members = list(members)
+
+
+class FakeContext:
+    """Prefix-command context: ctx.send() records the reply"""
+
+    def __init__(self, author, guild=None):
+        self.author = author
+        self.guild = guild
+        self.replies = []
+
+    async def send(self, content=None, embed=None, file=None):
+        self.replies.append((content, embed))
+
+    @property
+    def failed(self):
+        return any(content and content.startswith("❌") for content, _ in self.replies)
+
+
+class _FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self.deferred = False
+
+    async def defer(self, ephemeral=False, thinking=False):
+        self.deferred = True
+
+    async def send_message(self, content=None, embed=None, ephemeral=False):
+        self._interaction.edits.append((content, embed))
+
+
+class FakeInteraction:
+    """Slash-command interaction: the response and later edits are recorded"""
+
+    def __init__(self, user, guild=None, command=None):
+        self.user = user
+        self.guild = guild
+        self.command = command
+        self.extras = {}
+        self.response = _FakeResponse(self)
+        self.edits = []
+
+    async def edit_original_response(self, content=None, embed=None):
+        self.edits.append((content, embed))
+
+    @property
+    def failed(self):
+        """Whether the final answer wasn't a plain result.
+
+        Steam commands answer with an embed and no text; every error, busy,
+        rate-limited, invalid-ID and not-found path sets text instead (a
+        stale embed shown next to an error counts as failed too).
+        """
+        if not self.edits:
+            return True
+        content, embed = self.edits[-1]
+        return bool(content) or embed is None
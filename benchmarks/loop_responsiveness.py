@@ -0,0 +1,130 @@
+"""Checks the event loop keeps running while database calls are slow.
+
+Replaces DatabaseManager.execute_query with a blocking time.sleep, runs a
+batch of db.query() calls next to an asyncio.sleep(0.01) ticker, and exits
+non-zero if the ticker ever stalls for longer than MAX_GAP. For contrast it
+also reports the stall when the same call is made on the loop directly.
+Runs offline: the bot's DatabaseManager is built on a pool of do-nothing
+connections, so no MySQL server is needed. Usage:
+
+    python benchmarks/loop_responsiveness.py [queries] [query_seconds]
+"""
+import asyncio
+import functools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_pool  # noqa: E402
+
+
+class OfflineCursor:
+    """Accepts any statement and returns no rows"""
+    rowcount = 0
+    column_names = ()
+
+    def execute(self, query, params=None):
+        pass
+
+    def executemany(self, query, rows):
+        pass
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class OfflineConnection:
+    def cursor(self, **kwargs):
+        return OfflineCursor()
+
+    def start_transaction(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        pass
+
+
+# Importing db builds the bot's DatabaseManager (pool and tables) on the pool
+# class it finds in db_pool, so swap in one that never opens a socket
+db_pool.ConnectionPool = functools.partial(db_pool.ConnectionPool, connect=lambda config: OfflineConnection())
+os.environ.setdefault('DB_HOST', 'offline')
+os.environ.setdefault('DB_USER', 'benchmark')
+from db import db as database  # noqa: E402
+
+TICK = 0.01
+# Longest acceptable gap between ticks; a blocked loop stalls for a whole query
+MAX_GAP = 0.05
+
+
+async def ticker(gaps, stop):
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(TICK)
+        now = time.perf_counter()
+        gaps.append(now - last)
+        last = now
+
+
+async def measure(work):
+    """(longest tick gap, ticks) while `work` runs"""
+    gaps = []
+    stop = asyncio.Event()
+    task = asyncio.create_task(ticker(gaps, stop))
+    await asyncio.sleep(TICK)
+    await work()
+    stop.set()
+    await task
+    return max(gaps), len(gaps)
+
+
+async def run(db, queries, query_seconds):
+    def slow_query(query, params=None):
+        time.sleep(query_seconds)
+        return []
+
+    db.execute_query = slow_query
+
+    async def off_loop():
+        await asyncio.gather(*(db.query("SELECT 1") for _ in range(queries)))
+
+    async def on_loop():
+        for _ in range(queries):
+            db.execute_query("SELECT 1")
+
+    off_gap, off_ticks = await measure(off_loop)
+    on_gap, on_ticks = await measure(on_loop)
+    return off_gap, off_ticks, on_gap, on_ticks
+
+
+def main():
+    queries = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    query_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    try:
+        off_gap, off_ticks, on_gap, on_ticks = asyncio.run(run(database, queries, query_seconds))
+    finally:
+        database.close()
+
+    print(f"{queries} queries of {1000 * query_seconds:.0f}ms, ticker every {1000 * TICK:.0f}ms")
+    print(f"db.query() (executor):    longest tick gap {1000 * off_gap:7.1f}ms over {off_ticks} ticks")
+    print(f"execute_query() on loop:  longest tick gap {1000 * on_gap:7.1f}ms over {on_ticks} ticks")
+    if off_gap > MAX_GAP:
+        print(f"FAIL: the loop stalled for more than {1000 * MAX_GAP:.0f}ms while queries ran")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Resident memory of cached discord.Member objects vs the compact MemberIndex.
+
+Builds real discord.Member objects from synthetic gateway payloads (no
+connection needed) and measures what stays allocated with tracemalloc, once
+with every member in the library's cache (MEMBER_CACHE=full) and once with
+only the MemberIndex entries the lean policy keeps. Usage:
+
+    python benchmarks/member_memory.py [members] [guilds]
+"""
+import gc
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord  # noqa: E402
+
+from member_index import MemberIndex  # noqa: E402
+
+BASE_ID = 300_000_000_000_000_000
+NICK_SHARE = 0.15  # members with a per-guild nickname
+GLOBAL_NAME_SHARE = 0.6
+
+
+def fake_payloads(count, guilds):
+    """(guild_id, member payload) pairs; about a third of users share two guilds"""
+    payloads = []
+    for i in range(count):
+        user = {
+            'id': str(BASE_ID + i),
+            'username': f"user_{i:07d}",
+            'discriminator': '0',
+            'global_name': f"User {i}" if random.random() < GLOBAL_NAME_SHARE else None,
+            'avatar': f"{random.getrandbits(128):032x}",
+        }
+        for guild_id in {1 + i % guilds, 1 + (i * 7) % guilds if i % 3 == 0 else 1 + i % guilds}:
+            payloads.append((guild_id, {
+                'user': dict(user),
+                'nick': f"Nick {i}" if random.random() < NICK_SHARE else None,
+                'roles': [str(BASE_ID + random.randrange(50)) for _ in range(random.randrange(4))],
+                'joined_at': '2021-06-01T12:00:00.000000+00:00',
+                'deaf': False,
+                'mute': False,
+                'flags': 0,
+            }))
+    return payloads
+
+
+def make_guilds(state, count):
+    return {guild_id: discord.Guild(data={'id': str(guild_id), 'name': f"Guild {guild_id}"}, state=state)
+            for guild_id in range(1, count + 1)}
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return kept, current - before, peak - before
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    guild_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    random.seed(1)
+    payloads = fake_payloads(count, guild_count)
+    state = discord.Client(intents=discord.Intents.default())._connection
+    guilds = make_guilds(state, guild_count)
+
+    def full_cache():
+        for guild_id, payload in payloads:
+            guild = guilds[guild_id]
+            guild._add_member(discord.Member(data=payload, guild=guild, state=state))
+        return guilds
+
+    def lean_index():
+        # What GuildIndexer does with a cache=False chunk: build, index, drop
+        index = MemberIndex()
+        by_guild = {}
+        for guild_id, payload in payloads:
+            by_guild.setdefault(guild_id, []).append(payload)
+        for guild_id, chunk in by_guild.items():
+            members = [discord.Member(data=payload, guild=guilds[guild_id], state=state) for payload in chunk]
+            index.replace_guild(guild_id, members)
+            del members
+        return index
+
+    kept, full_bytes, _ = measure(full_cache)
+    memberships = sum(len(guild._members) for guild in kept.values())
+    for guild in kept.values():
+        guild._members.clear()
+    del kept
+
+    index, lean_bytes, lean_peak = measure(lean_index)
+    assert len(index) == memberships
+
+    per_100k = 100_000 / memberships
+    print(f"{memberships} memberships ({count} users) in {guild_count} guilds")
+    print(f"full member cache:  {full_bytes * per_100k / 2 ** 20:8.1f} MiB per 100k members")
+    print(f"lean member index:  {lean_bytes * per_100k / 2 ** 20:8.1f} MiB per 100k members "
+          f"(peak while indexing {lean_peak * per_100k / 2 ** 20:.1f} MiB)")
+    print(f"reduction: {full_bytes / lean_bytes:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
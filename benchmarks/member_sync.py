@@ -0,0 +1,61 @@
+"""Rows/sec for the old per-member INSERT vs the chunked multi-row upsert.
+
+Runs against the database configured in .env (same variables as db.py) and
+cleans up the synthetic rows it writes. Usage:
+
+    python benchmarks/member_sync.py [rows] [chunk_size]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing db connects using the bot's own DatabaseManager
+from db import db as database  # noqa: E402
+from db_statements import STATEMENTS  # noqa: E402
+
+# Synthetic user IDs live far above real Discord snowflakes
+BASE_ID = 9_000_000_000_000_000_000
+
+
+def fake_rows(count, offset):
+    return [(BASE_ID + offset + i, f"bench_user_{i}", f"Bench User {i}") for i in range(count)]
+
+
+def cleanup(db):
+    db.execute_update("DELETE FROM users WHERE user_id >= %s", (BASE_ID,))
+
+
+def bench_per_row(db, rows):
+    started = time.perf_counter()
+    for row in rows:
+        db.execute_update(STATEMENTS['insert_member'], row)
+    return time.perf_counter() - started
+
+
+def bench_chunked(db, rows, chunk_size):
+    started = time.perf_counter()
+    for i in range(0, len(rows), chunk_size):
+        db.execute_many(STATEMENTS['upsert_member'], rows[i:i + chunk_size])
+    return time.perf_counter() - started
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    db = database
+    try:
+        cleanup(db)
+        per_row = bench_per_row(db, fake_rows(count, 0))
+        chunked = bench_chunked(db, fake_rows(count, count), chunk_size)
+        print(f"per-row INSERT:      {count / per_row:10.0f} rows/s ({per_row:.2f}s for {count})")
+        print(f"chunked upsert x{chunk_size}: {count / chunked:10.0f} rows/s ({chunked:.2f}s for {count})")
+        print(f"speedup: {per_row / chunked:.1f}x")
+    finally:
+        cleanup(db)
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
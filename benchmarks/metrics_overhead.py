@@ -0,0 +1,67 @@
+"""Checks instrumentation stays inside its overhead budget.
+
+Times Metrics.observe() directly and the metrics.timed() wrapper around an
+empty coroutine, and exits non-zero if either costs more than BUDGET_US per
+call. No Discord or database connection needed. Usage:
+
+    python benchmarks/metrics_overhead.py [iterations]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Metrics  # noqa: E402
+
+# Per-call budget in microseconds; a command or statement takes milliseconds
+BUDGET_US = 5.0
+
+
+def bench_observe(metrics, iterations):
+    names = [f"statement_{i}" for i in range(50)]
+    started = time.perf_counter()
+    for i in range(iterations):
+        metrics.observe('db', names[i % 50], (i % 1000) / 1e5)
+    return time.perf_counter() - started
+
+
+async def bench_timed(metrics, iterations):
+    async def handler():
+        pass
+
+    timed = metrics.timed('event', 'handler')(handler)
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await handler()
+    bare = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await timed()
+    return time.perf_counter() - started - bare
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    metrics = Metrics()
+    results = {
+        'observe': 1e6 * bench_observe(metrics, iterations) / iterations,
+        'timed': 1e6 * asyncio.run(bench_timed(metrics, iterations)) / iterations,
+    }
+    start = time.perf_counter()
+    metrics.render_prometheus()
+    print(f"render_prometheus: {1000 * (time.perf_counter() - start):.2f}ms for {len(metrics.histograms)} series")
+
+    failed = False
+    for name, cost in results.items():
+        ok = cost <= BUDGET_US
+        failed |= not ok
+        print(f"{name:10} {cost:6.2f}us per call  {'ok' if ok else f'OVER BUDGET ({BUDGET_US}us)'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
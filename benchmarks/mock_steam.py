@@ -0,0 +1,126 @@
+"""Local stand-in for the Steam Web API and store API.
+
+Serves the endpoints SteamClient uses with deterministic fake data, after a
+configurable delay, and can answer a share of requests with 429. Point the
+bot at it with STEAM_API_BASE / STEAM_STORE_BASE. Standalone usage:
+
+    python benchmarks/mock_steam.py [--port 8099] [--latency-ms 80] [--jitter-ms 20] [--rate-limit-share 0]
+"""
+import argparse
+import asyncio
+import random
+import socket
+
+from aiohttp import web
+
+
+class MockSteam:
+    def __init__(self, latency=0.08, jitter=0.02, rate_limit_share=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_share = rate_limit_share
+        self.requests = {}  # endpoint -> count
+        self.rate_limited = 0
+        self._runner = None
+        self.port = None
+
+    async def _delay(self, endpoint):
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        await asyncio.sleep(max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+        if self.rate_limit_share and random.random() < self.rate_limit_share:
+            self.rate_limited += 1
+            raise web.HTTPTooManyRequests(headers={'Retry-After': '1'})
+
+    async def resolve_vanity(self, request):
+        await self._delay('ResolveVanityURL')
+        vanity = request.query.get('vanityurl', '')
+        if vanity.startswith('missing'):
+            return web.json_response({'response': {'success': 42, 'message': 'No match'}})
+        steam_id = 76561197960265728 + sum(map(ord, vanity)) * 7919
+        return web.json_response({'response': {'success': 1, 'steamid': str(steam_id)}})
+
+    async def player_summaries(self, request):
+        await self._delay('GetPlayerSummaries')
+        players = [{
+            'steamid': steam_id,
+            'personaname': f"player{steam_id[-6:]}",
+            'profileurl': f"https://steamcommunity.com/profiles/{steam_id}/",
+            'avatarfull': f"https://avatars.example/{steam_id}.jpg",
+            'communityvisibilitystate': 3,
+            'timecreated': 1262304000 + int(steam_id[-6:]),
+        } for steam_id in request.query.get('steamids', '').split(',') if steam_id]
+        return web.json_response({'response': {'players': players}})
+
+    async def recently_played(self, request):
+        await self._delay('GetRecentlyPlayedGames')
+        count = int(request.query.get('count', 5))
+        seed = int(request.query.get('steamid', '0')[-4:] or 0)
+        games = [{
+            'appid': 400 + (seed + i) * 10,
+            'name': f"Game {(seed + i) % 1000}",
+            'playtime_2weeks': 60 * (i + 1),
+            'playtime_forever': 600 * (i + 1),
+        } for i in range(count)]
+        return web.json_response({'response': {'total_count': len(games), 'games': games}})
+
+    async def app_details(self, request):
+        await self._delay('appdetails')
+        app_id = request.query.get('appids', '')
+        if not app_id.isdigit():
+            return web.json_response({app_id: {'success': False}})
+        return web.json_response({app_id: {'success': True, 'data': {
+            'name': f"Game {app_id}",
+            'short_description': "A game that only exists in benchmarks. " * 4,
+            'header_image': f"https://cdn.example/apps/{app_id}/header.jpg",
+            'developers': ["Bench Studio"],
+            'publishers': ["Bench Publishing"],
+            'is_free': int(app_id) % 3 == 0,
+            'price_overview': {'final_formatted': "$9.99"},
+            'release_date': {'date': "1 Jan, 2020"},
+        }}})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/ISteamUser/ResolveVanityURL/v1/', self.resolve_vanity)
+        app.router.add_get('/ISteamUser/GetPlayerSummaries/v0002/', self.player_summaries)
+        app.router.add_get('/IPlayerService/GetRecentlyPlayedGames/v0001/', self.recently_played)
+        app.router.add_get('/api/appdetails', self.app_details)
+        return app
+
+    async def start(self, port=0, host='127.0.0.1'):
+        """Serve on `port` (0 picks a free one); returns the base URL"""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        self.port = sock.getsockname()[1]
+        await web.SockSite(self._runner, sock).start()
+        return f"http://{host}:{self.port}"
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def serve(args):
+    mock = MockSteam(args.latency_ms / 1000, args.jitter_ms / 1000, args.rate_limit_share)
+    base = await mock.start(args.port)
+    print(f"Mock Steam listening on {base} (STEAM_API_BASE={base} STEAM_STORE_BASE={base})")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=80)
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--rate-limit-share', type=float, default=0.0)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Cost of resolving the command prefix for one message.
+
+Compares the in-memory GuildPrefixes lookup the bot uses with the naive
+approach of reading guilds.prefix per message. The database comparison only
+runs with --db (it uses the database configured in .env). Usage:
+
+    python benchmarks/prefix_resolution.py [messages] [--db]
+"""
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from guild_prefixes import GuildPrefixes  # noqa: E402
+
+GUILDS = 10_000
+CUSTOM_SHARE = 0.2  # fraction of guilds with a non-default prefix
+
+
+def fake_messages(count):
+    guilds = [SimpleNamespace(id=guild_id) for guild_id in range(1, GUILDS + 1)]
+    # A few DMs mixed in, like real traffic
+    return [SimpleNamespace(guild=random.choice(guilds) if i % 50 else None) for i in range(count)]
+
+
+def bench_memory(messages):
+    prefixes = GuildPrefixes(db=None)
+    prefixes.prefixes = {guild_id: '?' for guild_id in range(1, int(GUILDS * CUSTOM_SHARE) + 1)}
+    started = time.perf_counter()
+    for message in messages:
+        prefixes(None, message)
+    return time.perf_counter() - started
+
+
+def bench_database(messages):
+    from db import db as database
+
+    started = time.perf_counter()
+    for message in messages:
+        if message.guild is not None:
+            database.execute_query("SELECT prefix FROM guilds WHERE guild_id = %s", (message.guild.id,))
+    elapsed = time.perf_counter() - started
+    database.close()
+    return elapsed
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    count = int(args[0]) if args else 100_000
+    messages = fake_messages(count)
+
+    memory = bench_memory(messages)
+    print(f"in-memory   {1e9 * memory / count:10.0f}ns/message")
+    if '--db' in sys.argv:
+        sample = messages[:min(count, 2000)]
+        database = bench_database(sample)
+        print(f"per-message {1e9 * database / len(sample):10.0f}ns/message (database query)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Text queries vs cached prepared statements for the hot single-row statements.
+
+Runs against the database configured in .env (same variables as db.py) and
+cleans up the synthetic rows it writes. Usage:
+
+    python benchmarks/prepared_statements.py [iterations]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing db connects using the bot's own DatabaseManager
+from db import db as database  # noqa: E402
+from db_statements import STATEMENTS  # noqa: E402
+
+# Synthetic user IDs live far above real Discord snowflakes
+BASE_ID = 9_100_000_000_000_000_000
+
+
+def params_for(name, i):
+    if name == 'select_user':
+        return (BASE_ID + i % 100,)
+    return (BASE_ID + i % 100, f"bench_user_{i}", f"Bench User {i}")
+
+
+def bench_text(db, name, iterations):
+    run = db.execute_query if name.startswith('select') else db.execute_update
+    started = time.perf_counter()
+    for i in range(iterations):
+        run(STATEMENTS[name], params_for(name, i))
+    return time.perf_counter() - started
+
+
+def bench_prepared(db, name, iterations):
+    fetch = name.startswith('select')
+    started = time.perf_counter()
+    for i in range(iterations):
+        db.execute_prepared(name, params_for(name, i), fetch)
+    return time.perf_counter() - started
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    db = database
+    try:
+        for i in range(100):
+            db.execute_update(STATEMENTS['upsert_member'], params_for('upsert_member', i))
+        for name in ('select_user', 'insert_member', 'upsert_member'):
+            text = bench_text(db, name, iterations)
+            prepared = bench_prepared(db, name, iterations)
+            print(f"{name:15} text {1e6 * text / iterations:8.1f}us  "
+                  f"prepared {1e6 * prepared / iterations:8.1f}us  "
+                  f"({text / prepared:.2f}x)")
+    finally:
+        db.execute_update("DELETE FROM users WHERE user_id >= %s", (BASE_ID,))
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import sys
+import time
+from collections import OrderedDict
+
+
+def approx_size(value):
+    """Rough deep size in bytes of a JSON-like value (dicts, lists, scalars)"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += approx_size(k) + approx_size(v)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += approx_size(item)
+    return size
+
+
+class TTLCache:
+    """Bounded in-memory cache with per-entry TTL, LRU eviction and a memory cap.
+
+    Entries past their TTL are treated as misses by get() but kept until
+    evicted, so peek() can still hand back a stale copy.
+    """
+
+    def __init__(self, maxsize=1024, max_bytes=None, default_ttl=300, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.clock = clock
+        self._data = OrderedDict()  # key -> (value, expires_at, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[1] > self.clock()
+
+    def get(self, key, default=None):
+        """Return a fresh cached value, or default on a miss"""
+        entry = self._data.get(key)
+        if entry is None or entry[1] <= self.clock():
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def peek(self, key):
+        """Return (value, is_fresh) even for expired entries, or None if absent"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        return entry[0], entry[1] > self.clock()
+
+    def ttl_left(self, key):
+        """Seconds until an entry expires (negative once stale), or None if absent"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        return entry[1] - self.clock()
+
+    def set(self, key, value, ttl=None, size=None):
+        if ttl is None:
+            ttl = self.default_ttl
+        if size is None:
+            size = approx_size(value)
+        # Drop the old value even when the new one is too big to keep, so it isn't served as current
+        self.pop(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self._data[key] = (value, self.clock() + ttl, size)
+        self.bytes += size
+        self._evict()
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        self.bytes -= entry[2]
+        return entry[0]
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def _evict(self):
+        while self._data and (len(self._data) > self.maxsize or
+                              (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            _, (_, _, size) = self._data.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
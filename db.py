@@ -1,12 +1,32 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 import discord
+import io
 import mysql.connector
-from mysql.connector import pooling, Error
+from mysql.connector import Error
 from discord.ext import commands
 import os
+import threading
+import time
 from dotenv import load_dotenv
 import logging
 from urllib.parse import urlparse
 
+from activity_log import ActivityLog
+from db_pool import ConnectionPool, PoolError
+from db_statements import STATEMENTS, statement_label
+from guild_prefixes import GuildPrefixes
+import loop_watchdog
+from leaderboard import Leaderboards
+from metrics import LoopLagMonitor, MetricsServer, format_seconds, metrics
+from member_index import GuildIndexer, MemberIndex, cache_options, install_gateway_hook
+from member_sync import MemberSync
+from profile_cache import ProfileCache
+from sharding import ShardStatus, shard_config
+from stats import DatabaseStats
+from write_buffer import POINTS_MAX, POINTS_MIN, WriteBehindBuffer
+
 # Load environment variables
 load_dotenv()
 
@@ -35,8 +55,15 @@ def parse_database_url(database_url):
 
 
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, pool_min=None, pool_max=None):
         self.pool = None
+        self.pool_min = pool_min or int(os.getenv('DB_POOL_MIN', 2))
+        self.pool_max = pool_max or int(os.getenv('DB_POOL_MAX', 10))
+        # One worker per connection the pool may open; queries beyond that
+        # queue here (counted in self.queued) rather than in the pool
+        self.executor = ThreadPoolExecutor(max_workers=self.pool_max, thread_name_prefix='db')
+        self.queued = 0
+        self._queued_lock = threading.Lock()
         self.create_connection_pool()
         self.create_tables()
 
@@ -64,9 +91,6 @@ class DatabaseManager:
 
             config = {
                 **db_config,
-                'pool_name': 'discord_bot_pool',
-                'pool_size': 3,
-                'pool_reset_session': True,
                 'autocommit': True,
                 'connect_timeout': 30,
                 'sql_mode': 'TRADITIONAL'
@@ -78,8 +102,16 @@ class DatabaseManager:
             logger.info(f"Connecting to Railway MySQL: {config['host']}:{config['port']}")
             logger.info(f"Database: {config['database']}, User: {config['user']}")
 
-            self.pool = pooling.MySQLConnectionPool(**config)
-            logger.info("✅ Railway MySQL connection pool created successfully")
+            self.pool = ConnectionPool(
+                config,
+                min_size=self.pool_min,
+                max_size=self.pool_max,
+                timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+                grow_after=float(os.getenv('DB_POOL_GROW_AFTER', 0.05)),
+                idle_timeout=float(os.getenv('DB_POOL_IDLE_TIMEOUT', 300)),
+            )
+            logger.info(f"✅ Railway MySQL connection pool created successfully "
+                        f"({self.pool_min}-{self.pool_max} connections)")
 
         except Exception as e:
             logger.error(f"❌ Error creating connection pool: {e}")
@@ -93,13 +125,30 @@ class DatabaseManager:
         """Get connection from pool"""
         try:
             return self.pool.get_connection()
-        except Error as e:
+        except (Error, PoolError) as e:
             logger.error(f"Error getting connection from pool: {e}")
             raise
 
+    def _mark_broken(self, connection, error):
+        """Have the pool drop a connection a lost-connection error left unusable"""
+        if connection is not None and isinstance(error, (mysql.connector.InterfaceError,
+                                                         mysql.connector.OperationalError)):
+            connection.broken = True
+
+    def _release(self, connection, cursor):
+        """Close the cursor and hand the connection back to the pool"""
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Error:
+                pass
+        if connection is not None:
+            connection.close()
+
     def execute_query(self, query, params=None):
         """Execute SELECT query and return results"""
         connection = None
+        cursor = None
         try:
             connection = self.get_connection()
             cursor = connection.cursor(dictionary=True)
@@ -107,18 +156,18 @@ class DatabaseManager:
             result = cursor.fetchall()
             return result
 
-        except Error as e:
+        except (Error, PoolError) as e:
             logger.error(f"Database query error: {e}")
+            self._mark_broken(connection, e)
             return None
 
         finally:
-            if connection and connection.is_connected():
-                cursor.close()
-                connection.close()
+            self._release(connection, cursor)
 
     def execute_update(self, query, params=None):
         """Execute INSERT/UPDATE/DELETE query"""
         connection = None
+        cursor = None
         try:
             connection = self.get_connection()
             cursor = connection.cursor()
@@ -126,14 +175,157 @@ class DatabaseManager:
             affected_rows = cursor.rowcount
             return affected_rows
 
-        except Error as e:
+        except (Error, PoolError) as e:
             logger.error(f"Database update error: {e}")
+            self._mark_broken(connection, e)
             return 0
 
         finally:
-            if connection and connection.is_connected():
-                cursor.close()
-                connection.close()
+            self._release(connection, cursor)
+
+    def execute_many(self, query, rows):
+        """Execute one INSERT/UPDATE for many parameter rows in a single transaction.
+
+        Returns the affected row count, which is 0 when every row was already
+        up to date, or None if the batch failed and was rolled back.
+        """
+        if not rows:
+            return 0
+        connection = None
+        cursor = None
+        try:
+            connection = self.get_connection()
+            cursor = connection.cursor()
+            connection.start_transaction()
+            # mysql-connector rewrites INSERT ... VALUES into one multi-row statement
+            cursor.executemany(query, rows)
+            affected_rows = cursor.rowcount
+            connection.commit()
+            return affected_rows
+
+        except (Error, PoolError) as e:
+            logger.error(f"Database batch error: {e}")
+            self._mark_broken(connection, e)
+            if connection and not connection.broken:
+                connection.rollback()
+            return None
+
+        finally:
+            self._release(connection, cursor)
+
+    def execute_transaction(self, statements):
+        """Run [(query, rows), ...] in one transaction, each query once per params row.
+
+        Returns True once committed, False if the database rejected the
+        statements (rolled back), or None if the connection failed.
+        """
+        connection = None
+        cursor = None
+        try:
+            connection = self.get_connection()
+            cursor = connection.cursor()
+            connection.start_transaction()
+            for query, rows in statements:
+                if rows:
+                    cursor.executemany(query, rows)
+            connection.commit()
+            return True
+
+        except (Error, PoolError) as e:
+            logger.error(f"Database transaction error: {e}")
+            self._mark_broken(connection, e)
+            if connection is None or connection.broken:
+                return None
+            connection.rollback()
+            return False
+
+        finally:
+            self._release(connection, cursor)
+
+    def _prepared_cursor(self, connection, name):
+        """Prepared cursor for a named statement, prepared once per connection"""
+        cursor = connection.statement_cache.get(name)
+        if cursor is None:
+            cursor = connection.cursor(prepared=True)
+            connection.statement_cache[name] = cursor
+        return cursor
+
+    def execute_prepared(self, name, params=(), fetch=False):
+        """Execute a named statement as a server-side prepared statement.
+
+        Returns rows as dicts when fetch is set, otherwise the affected row count
+        (None / 0 on error, like execute_query / execute_update).
+        """
+        connection = None
+        try:
+            connection = self.get_connection()
+            cursor = self._prepared_cursor(connection, name)
+            cursor.execute(STATEMENTS[name], params)
+            if fetch:
+                columns = cursor.column_names
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return cursor.rowcount
+
+        except (Error, PoolError) as e:
+            logger.error(f"Database error in prepared statement '{name}': {e}")
+            self._mark_broken(connection, e)
+            if connection is not None:
+                connection.statement_cache.pop(name, None)
+            return None if fetch else 0
+
+        finally:
+            self._release(connection, None)
+
+    async def _run(self, label, func, *args):
+        """Run a blocking DatabaseManager call on the executor, tracking queue length and timings"""
+        submitted = time.perf_counter()
+
+        def started():
+            with self._queued_lock:
+                self.queued -= 1
+            begun = time.perf_counter()
+            metrics.observe('db_queue', 'executor', begun - submitted)
+            try:
+                return func(*args)
+            finally:
+                metrics.observe('db', label, time.perf_counter() - begun)
+
+        with self._queued_lock:
+            self.queued += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, started)
+
+    async def query(self, query, params=None):
+        """Async execute_query; runs on the database thread pool, off the event loop"""
+        return await self._run(statement_label(query), self.execute_query, query, params)
+
+    async def update(self, query, params=None):
+        """Async execute_update; runs on the database thread pool, off the event loop"""
+        return await self._run(statement_label(query), self.execute_update, query, params)
+
+    async def prepared_query(self, name, params=()):
+        """Async execute_prepared for a named SELECT; returns rows as dicts"""
+        return await self._run(name, self.execute_prepared, name, params, True)
+
+    async def prepared_update(self, name, params=()):
+        """Async execute_prepared for a named INSERT/UPDATE/DELETE; returns the row count"""
+        return await self._run(name, self.execute_prepared, name, params)
+
+    async def update_many(self, query, rows):
+        """Async execute_many; runs on the database thread pool, off the event loop"""
+        return await self._run(statement_label(query), self.execute_many, query, rows)
+
+    async def transaction(self, statements):
+        """Async execute_transaction; runs on the database thread pool, off the event loop"""
+        return await self._run('transaction', self.execute_transaction, statements)
+
+    def pool_stats(self):
+        return {**self.pool.stats(), 'queued': self.queued}
+
+    def close(self):
+        """Wait for queued queries to finish, stop the worker threads and close connections"""
+        self.executor.shutdown(wait=True)
+        self.pool.close()
 
     def create_tables(self):
         """Create necessary tables"""
@@ -154,7 +346,7 @@ class DatabaseManager:
                 CREATE TABLE IF NOT EXISTS guilds (
                     guild_id BIGINT PRIMARY KEY,
                     guild_name VARCHAR(255) NOT NULL,
-                    prefix VARCHAR(10) DEFAULT '!',
+                    prefix VARCHAR(10) DEFAULT NULL,
                     welcome_channel BIGINT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
@@ -168,6 +360,21 @@ class DatabaseManager:
                     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
                 )
+            """,
+            'guild_points': """
+                CREATE TABLE IF NOT EXISTS guild_points (
+                    guild_id BIGINT,
+                    user_id BIGINT,
+                    points INT DEFAULT 0,
+                    PRIMARY KEY (guild_id, user_id),
+                    INDEX idx_guild_points (guild_id, points)
+                )
+            """,
+            'write_batches': """
+                CREATE TABLE IF NOT EXISTS write_batches (
+                    batch_id VARCHAR(32) PRIMARY KEY,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
             """
         }
 
@@ -178,100 +385,230 @@ class DatabaseManager:
             except Exception as e:
                 logger.error(f"Error creating table '{table_name}': {e}")
 
-
-async def store_all_members():
-    """Store all members from all guilds in the database"""
-    total_stored = 0
-
-    for guild in bot.guilds:
-        # Store guild info
-        db.execute_update(
-            "INSERT IGNORE INTO guilds (guild_id, guild_name) VALUES (%s, %s)",
-            (guild.id, guild.name)
+        # Indexes added after the tables first shipped
+        self.ensure_index('users', 'idx_points', '(points)')
+        self.ensure_index('users', 'idx_updated_at', '(updated_at)')
+        self.migrate_prefix_default()
+        self.backfill_guild_points()
+
+    def ensure_index(self, table, index_name, columns):
+        """Add an index to an existing table unless it's already there"""
+        existing = self.execute_query(
+            """SELECT 1 FROM information_schema.statistics
+               WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+               LIMIT 1""",
+            (table, index_name)
+        )
+        if existing is None or existing:
+            return
+        self.execute_update(f"ALTER TABLE {table} ADD INDEX {index_name} {columns}")
+        logger.info(f"Index '{index_name}' added to '{table}'")
+
+    def migrate_prefix_default(self):
+        """guilds.prefix used to default to '!'; NULL now means the bot's DEFAULT_PREFIX"""
+        column = self.execute_query(
+            """SELECT column_default AS column_default FROM information_schema.columns
+               WHERE table_schema = DATABASE() AND table_name = 'guilds' AND column_name = 'prefix'"""
+        )
+        if not column or column[0]['column_default'] not in ('!', "'!'"):
+            return
+        # Rows first: if this stops part way, the default is still '!' and the next start redoes it
+        rows = self.execute_update("UPDATE guilds SET prefix = NULL WHERE prefix = '!'")
+        self.execute_update("ALTER TABLE guilds ALTER COLUMN prefix SET DEFAULT NULL")
+        logger.info(f"guilds.prefix now defaults to NULL; cleared {rows} '!' prefixes")
+
+    def backfill_guild_points(self):
+        """Seed guild_points from the points_added_N activity log the first time it's empty"""
+        result = self.execute_query("SELECT 1 FROM guild_points LIMIT 1")
+        if result is None or result:
+            return
+        rows = self.execute_update(
+            """INSERT INTO guild_points (guild_id, user_id, points)
+               SELECT guild_id, user_id, SUM(CAST(SUBSTRING(activity_type, 14) AS SIGNED))
+               FROM user_activity
+               WHERE activity_type LIKE 'points\\_added\\_%' AND guild_id IS NOT NULL
+               GROUP BY guild_id, user_id"""
         )
+        logger.info(f"Backfilled {rows} guild_points rows from user_activity")
 
-        # Store all members
-        for member in guild.members:
-            if not member.bot:  # Skip bot accounts
-                result = db.execute_update(
-                    """INSERT IGNORE INTO users (user_id, username, display_name) 
-                       VALUES (%s, %s, %s)""",
-                    (member.id, str(member), member.display_name)
-                )
-                if result > 0:
-                    total_stored += 1
 
-    logger.info(f"Stored {total_stored} new members in database")
-    print(f"Stored {total_stored} new members in database")
+async def store_all_members(guilds=None):
+    """Store new and changed members from all indexed guilds (or the given ones) in the database"""
+    started = time.perf_counter()
+    checked, written = await member_sync.sync(bot.guilds if guilds is None else guilds)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Member sync: checked {checked} members, wrote {written} in {elapsed:.1f}s")
+    print(f"Member sync: checked {checked} members, wrote {written} in {elapsed:.1f}s")
+
 
+# Sharding: unset runs every shard in this process; the launcher sets a range per process
+shard_count, shard_ids, cluster = shard_config()
 
 # Initialize database manager
 db = DatabaseManager()
+db_stats = DatabaseStats(db)
+# Members are kept as compact index entries; MEMBER_CACHE=full restores discord.py's member cache
+member_cache = os.getenv('MEMBER_CACHE', 'lean')
+member_index = MemberIndex()
+member_sync = MemberSync(db, member_index, stats=db_stats, shard_ids=shard_ids, shard_count=shard_count)
+guild_indexer = GuildIndexer(member_index, member_cache, os.getenv('MEMBER_CHUNKING', 'lazy'),
+                             on_indexed=lambda guild: member_sync.sync([guild]))
+
+
+def revert_dead_letter(op):
+    """Take a points write the database will never accept back out of the in-memory state"""
+    if op['op'] != 'points':
+        return
+    user_id, amount = op['user_id'], op['amount']
+    db_stats.points_changed(leaderboards.board().points(user_id), -amount)
+    leaderboards.add_points(op['guild_id'], user_id, -amount, op['username'])
+    profiles.add_points(user_id, -amount)
+
+
+# Each process needs its own journal, or one would replay another's pending batches
+write_buffer = WriteBehindBuffer(db, journal_dir=os.getenv(
+    'WRITE_JOURNAL_DIR', 'write_journal' if shard_ids is None else os.path.join('write_journal', cluster)),
+    on_dead_letter=revert_dead_letter)
+leaderboards = Leaderboards(db)
+guild_prefixes = GuildPrefixes(db, default=os.getenv('DEFAULT_PREFIX', '!'))
+activity_log = ActivityLog(db, retention_days=int(os.getenv('ACTIVITY_RETENTION_DAYS', 90)))
+profiles = ProfileCache(
+    db, write_buffer,
+    maxsize=int(os.getenv('PROFILE_CACHE_SIZE', 10000)),
+    max_bytes=int(os.getenv('PROFILE_CACHE_BYTES', 8 * 1024 * 1024)),
+    stats=db_stats,
+)
+
+loop_lag = LoopLagMonitor(metrics)
+watchdog = loop_watchdog.from_env(metrics)
+metrics_port = os.getenv('DB_METRICS_PORT')
+metrics_server = MetricsServer(metrics, int(metrics_port)) if metrics_port else None
+# Pending and failed batches, rows written and dead-lettered writes of the write-behind buffer
+metrics.register_gauges('write_buffer', write_buffer.stats)
 
 # Bot setup
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+
+
+class DatabaseBot(commands.AutoShardedBot):
+    async def setup_hook(self):
+        install_gateway_hook(self, member_index)
+        loop_lag.start()
+        watchdog.start()
+        if metrics_server is not None:
+            await metrics_server.start()
+        # activity_log must exist before the journal replay writes into it
+        # Partition DDL and the legacy migration run in one process only
+        await activity_log.start(maintain=shard_status.is_coordinator)
+        await write_buffer.start()
+        await leaderboards.load(shard_ids, shard_count)
+        if shard_ids is not None:
+            # Other processes change global points; read the users rows they touched since the last refresh
+            leaderboards.start_refresh(int(os.getenv('LEADERBOARD_REFRESH', 60)), write_buffer)
+        # Prefixes are only needed for this process's guilds; the stats users scan runs on the coordinator
+        await guild_prefixes.load(shard_ids, shard_count)
+        await db_stats.start(periodic=shard_status.is_coordinator)
+        await shard_status.start()
+
+    async def close(self):
+        await super().close()
+        db_stats.close()
+        activity_log.close()
+        leaderboards.close()
+        shard_status.close()
+        guild_indexer.close()
+        # Flush buffered writes before the loop goes away
+        await write_buffer.close()
+        loop_lag.close()
+        watchdog.close()
+        if metrics_server is not None:
+            await metrics_server.close()
+
+    async def invoke(self, ctx):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+        # Name the task after the command so loop stalls are attributed to it
+        asyncio.current_task().set_name(f"command:{ctx.command.qualified_name}")
+        guild_indexer.touch(ctx.guild)
+        started = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            metrics.observe('command', ctx.command.qualified_name, time.perf_counter() - started)
+
+
+bot = DatabaseBot(command_prefix=guild_prefixes, intents=intents, shard_count=shard_count, shard_ids=shard_ids,
+                  **cache_options(member_cache, intents))
+shard_status = ShardStatus(db, bot, cluster, loop_lag=loop_lag)
 
 
 @bot.event
+@metrics.timed('event')
 async def on_ready():
     logger.info(f'{bot.user} has connected to Discord!')
     print(f'{bot.user} has connected to Discord!')
 
-    # Store all existing members from all guilds
-    await store_all_members()
+    # Index every guild's members (chunking them unless MEMBER_CACHE=full) and store
+    # new and changed ones as each guild is indexed; a new session may have missed updates
+    guild_indexer.start(bot.guilds)
 
 
 @bot.event
+@metrics.timed('event')
 async def on_guild_join(guild):
     """Register guild when bot joins"""
-    db.execute_update(
-        "INSERT IGNORE INTO guilds (guild_id, guild_name) VALUES (%s, %s)",
-        (guild.id, guild.name)
-    )
+    inserted = await db.prepared_update('insert_guild', (guild.id, guild.name))
+    db_stats.guilds_added(inserted)
+    member_sync.known_guilds.add(guild.id)
+    await guild_prefixes.load_guild(guild.id)
+    if guild_indexer.eager:
+        await guild_indexer.ensure(guild)
+
+
+@bot.event
+@metrics.timed('event')
+async def on_guild_remove(guild):
+    # Users left in none of this process's guilds no longer need their stored names mirrored
+    for user_id in member_index.drop_guild(guild.id):
+        member_sync.forget(user_id)
+    guild_prefixes.forget(guild.id)
 
 
 @bot.event
+@metrics.timed('event')
 async def on_member_join(member):
     """Register new member"""
     if not member.bot:
-        db.execute_update(
-            """INSERT IGNORE INTO users (user_id, username, display_name) 
-               VALUES (%s, %s, %s)""",
-            (member.id, str(member), member.display_name)
-        )
+        stored = await db.prepared_update('insert_member', (member.id, str(member), member.display_name))
+        if stored:
+            db_stats.users_added()
+            member_sync.remember(member.id, str(member), member.display_name)
+        member_index.add_member(member)
         logger.info(f"New member stored: {member} ({member.id})")
 
 
 @bot.event
-async def on_member_update(before, after):
-    """Update member info when they change their name/display name"""
-    if not after.bot:
-        if before.name != after.name or before.display_name != after.display_name:
-            db.execute_update(
-                """INSERT INTO users (user_id, username, display_name) 
-                   VALUES (%s, %s, %s)
-                   ON DUPLICATE KEY UPDATE 
-                   username = VALUES(username),
-                   display_name = VALUES(display_name)""",
-                (after.id, str(after), after.display_name)
-            )
-            logger.info(f"Updated member info: {after} ({after.id})")
+async def on_raw_member_remove(payload):
+    if member_index.remove(payload.guild_id, payload.user.id):
+        member_sync.forget(payload.user.id)
 
 
 @bot.event
-async def on_user_update(before, after):
-    """Update user info when they change their global username"""
-    if not after.bot:
-        if before.name != after.name:
-            db.execute_update(
-                """UPDATE users SET username = %s WHERE user_id = %s""",
-                (str(after), after.id)
-            )
-            logger.info(f"Updated username: {before.name} -> {after.name} ({after.id})")
+@metrics.timed('event')
+async def on_member_names_update(guild_id, user_id, before, after):
+    """Update member info when they change their username or display name (see member_index)"""
+    username, display_name = after
+    # A username change arrives once per shared guild; keep the stored display name then
+    if before is not None and before[1] == display_name:
+        display_name = None
+    await write_buffer.update_user(user_id, username, display_name)
+    profiles.update_names(user_id, username, display_name)
+    leaderboards.rename(user_id, username)
+    member_sync.remember(user_id, username, display_name)
+    logger.info(f"Updated member info: {username} ({user_id})")
 
 
 # User Commands
@@ -280,24 +617,7 @@ async def user_profile(ctx, user: discord.Member = None):
     """Display user profile"""
     target_user = user or ctx.author
 
-    result = db.execute_query(
-        "SELECT * FROM users WHERE user_id = %s",
-        (target_user.id,)
-    )
-
-    if not result:
-        db.execute_update(
-            """INSERT INTO users (user_id, username, display_name) 
-               VALUES (%s, %s, %s)""",
-            (target_user.id, str(target_user), target_user.display_name)
-        )
-
-        result = db.execute_query(
-            "SELECT * FROM users WHERE user_id = %s",
-            (target_user.id,)
-        )
-
-    user_data = result[0]
+    user_data = await profiles.get(target_user)
 
     embed = discord.Embed(
         title=f"{target_user.display_name}'s Profile",
@@ -316,88 +636,130 @@ async def user_profile(ctx, user: discord.Member = None):
 @commands.has_permissions(administrator=True)
 async def add_points(ctx, user: discord.Member, amount: int):
     """Add points to a user (Admin only)"""
-    existing = db.execute_query(
-        "SELECT user_id FROM users WHERE user_id = %s",
-        (user.id,)
-    )
-
-    if not existing:
-        db.execute_update(
-            """INSERT INTO users (user_id, username, display_name) 
-               VALUES (%s, %s, %s)""",
-            (user.id, str(user), user.display_name)
-        )
+    totals = (amount, leaderboards.board().points(user.id) + amount,
+              leaderboards.board(ctx.guild.id).points(user.id) + amount)
+    if not all(POINTS_MIN <= total <= POINTS_MAX for total in totals):
+        await ctx.send(f"❌ Points totals must stay between {POINTS_MIN} and {POINTS_MAX}.")
+        return
+    # Journaled and acknowledged now; the user row, points delta and activity
+    # entry reach MySQL in the next merged flush
+    await write_buffer.add_points(user.id, ctx.guild.id, amount, str(user), user.display_name)
+    profiles.add_points(user.id, amount)
+    db_stats.points_changed(leaderboards.board().points(user.id), amount)
+    leaderboards.add_points(ctx.guild.id, user.id, amount, str(user))
 
-    rows_affected = db.execute_update(
-        "UPDATE users SET points = points + %s WHERE user_id = %s",
-        (amount, user.id)
+    embed = discord.Embed(
+        description=f"✅ Added {amount} points to {user.mention}!",
+        color=discord.Color.green()
     )
-
-    if rows_affected > 0:
-        db.execute_update(
-            """INSERT INTO user_activity (user_id, guild_id, activity_type) 
-               VALUES (%s, %s, %s)""",
-            (user.id, ctx.guild.id, f'points_added_{amount}')
-        )
-
-        embed = discord.Embed(
-            description=f"✅ Added {amount} points to {user.mention}!",
-            color=discord.Color.green()
-        )
-        await ctx.send(embed=embed)
-    else:
-        await ctx.send("❌ Failed to add points.")
+    await ctx.send(embed=embed)
 
 
 @bot.command(name='leaderboard', aliases=['lb', 'top'])
 async def leaderboard(ctx, limit: int = 10):
-    """Show points leaderboard"""
+    """Show this server's points leaderboard"""
     if limit > 20:
         limit = 20
 
-    results = db.execute_query(
-        """SELECT user_id, username, points, level 
-           FROM users 
-           ORDER BY points DESC 
-           LIMIT %s""",
-        (limit,)
-    )
+    board = leaderboards.board(ctx.guild.id if ctx.guild else None)
+    await send_leaderboard(ctx, board.top(limit), "🏆 Leaderboard")
+
 
+@bot.command(name='globalleaderboard', aliases=['glb'])
+async def global_leaderboard(ctx, limit: int = 10):
+    """Show the points leaderboard across every server"""
+    if limit > 20:
+        limit = 20
+
+    await send_leaderboard(ctx, leaderboards.board().top(limit), "🌍 Global Leaderboard")
+
+
+async def send_leaderboard(ctx, results, title):
     if not results:
         await ctx.send("No users found in the database.")
         return
 
     embed = discord.Embed(
-        title="🏆 Leaderboard",
+        title=title,
         color=discord.Color.gold()
     )
 
     description = ""
-    for i, user_data in enumerate(results, 1):
+    for i, (user_id, points) in enumerate(results, 1):
         medal = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"{i}."
-        description += f"{medal} **{user_data['username']}** - {user_data['points']} points\n"
+        username = leaderboards.usernames.get(user_id, user_id)
+        description += f"{medal} **{username}** - {points} points\n"
 
     embed.description = description
     await ctx.send(embed=embed)
 
 
-@bot.command(name='dbstats')
-@commands.has_permissions(administrator=True)
-async def database_stats(ctx):
-    """Show database statistics (Admin only)"""
-    stats = {}
+@bot.command(name='rank')
+async def rank(ctx, user: discord.Member = None):
+    """Show a user's leaderboard rank in this server and globally"""
+    target_user = user or ctx.author
+
+    embed = discord.Embed(
+        title=f"{target_user.display_name}'s Rank",
+        color=discord.Color.gold()
+    )
+    boards = [("Global", leaderboards.board())]
+    if ctx.guild:
+        boards.insert(0, (ctx.guild.name, leaderboards.board(ctx.guild.id)))
+    for name, board in boards:
+        position = board.rank(target_user.id)
+        value = f"#{position} of {len(board)} ({board.points(target_user.id)} points)" if position else "Unranked"
+        embed.add_field(name=name, value=value, inline=True)
+
+    await ctx.send(embed=embed)
+
 
-    result = db.execute_query("SELECT COUNT(*) as count FROM users")
-    stats['users'] = result[0]['count'] if result else 0
+@bot.command(name='activity')
+async def activity(ctx, user: discord.Member = None, days: int = 7):
+    """Show a user's daily activity in this server"""
+    if not ctx.guild:
+        await ctx.send("❌ This command only works in a server.")
+        return
+    target_user = user or ctx.author
+    days = max(1, min(days, activity_log.retention_days))
+    rows = await activity_log.history(ctx.guild.id, target_user.id, days)
 
-    result = db.execute_query("SELECT COUNT(*) as count FROM guilds")
-    stats['guilds'] = result[0]['count'] if result else 0
+    embed = discord.Embed(
+        title=f"{target_user.display_name}'s Activity (last {days} days)",
+        color=discord.Color.blue()
+    )
+    if not rows:
+        embed.description = "No activity recorded."
+    else:
+        embed.description = "\n".join(
+            f"**{row['day']}** - {row['activity_type']}: {row['events']}x ({row['amount']:+})"
+            for row in rows[:25]
+        )
+    await ctx.send(embed=embed)
+
+
+@bot.command(name='setprefix')
+@commands.has_permissions(administrator=True)
+async def set_prefix(ctx, prefix: str):
+    """Change the command prefix for this server (Admin only)"""
+    if not ctx.guild:
+        await ctx.send("❌ This command only works in a server.")
+        return
+    problem = guild_prefixes.validate(prefix)
+    if problem:
+        await ctx.send(f"❌ {problem}")
+        return
+    if await guild_prefixes.set(ctx.guild.id, ctx.guild.name, prefix):
+        await ctx.send(f"✅ Command prefix set to `{prefix}`")
+    else:
+        await ctx.send("❌ Failed to update the prefix.")
 
-    result = db.execute_query("SELECT SUM(points) as total FROM users")
-    stats['total_points'] = result[0]['total'] if result and result[0]['total'] else 0
 
-    result = db.execute_query("SELECT COUNT(*) as count FROM users WHERE points > 0")
-    stats['active_users'] = result[0]['count'] if result else 0
+@bot.command(name='dbstats')
+@commands.has_permissions(administrator=True)
+async def database_stats(ctx):
+    """Show database statistics (Admin only)"""
+    stats = db_stats.current()
 
     embed = discord.Embed(
         title="📊 Database Statistics",
@@ -407,7 +769,137 @@ async def database_stats(ctx):
     embed.add_field(name="Active Users", value=stats['active_users'], inline=True)
     embed.add_field(name="Total Guilds", value=stats['guilds'], inline=True)
     embed.add_field(name="Total Points", value=stats['total_points'], inline=False)
+    if stats['age'] is not None:
+        embed.set_footer(text=f"Live counters, last reconciled {int(stats['age'])}s ago")
+    else:
+        embed.set_footer(text="Counters are being reconciled; run the command again shortly")
+
+    await ctx.send(embed=embed)
+
 
+@bot.command(name='dbpool')
+@commands.has_permissions(administrator=True)
+async def database_pool(ctx):
+    """Show connection pool metrics (Admin only)"""
+    stats = db.pool_stats()
+
+    embed = discord.Embed(
+        title="🔌 Connection Pool",
+        color=discord.Color.purple()
+    )
+    embed.add_field(name="Open", value=f"{stats['size']} ({db.pool_min}-{db.pool_max})", inline=True)
+    embed.add_field(name="In Use", value=stats['in_use'], inline=True)
+    embed.add_field(name="Idle", value=stats['idle'], inline=True)
+    embed.add_field(name="Queued", value=stats['queued'], inline=True)
+    embed.add_field(name="Waiting", value=stats['waiting'], inline=True)
+    embed.add_field(
+        name="Checkout",
+        value=f"avg {stats['avg_checkout_ms']:.1f}ms / max {stats['max_checkout_ms']:.1f}ms",
+        inline=True
+    )
+    embed.add_field(name="Timeouts", value=stats['timeouts'], inline=True)
+    embed.add_field(name="Errors", value=stats['errors'], inline=True)
+
+    await ctx.send(embed=embed)
+
+
+@bot.command(name='metrics')
+@commands.has_permissions(administrator=True)
+async def show_metrics(ctx, kind: str = 'command'):
+    """Show the slowest commands, events or statements by p99 (Admin only)"""
+    rows = metrics.top(kind)
+
+    embed = discord.Embed(
+        title=f"⏱️ Latency: {kind}",
+        color=discord.Color.purple()
+    )
+    if not rows:
+        embed.description = "Nothing recorded yet. Kinds: command, event, db, db_queue, loop"
+    else:
+        embed.description = "\n".join(
+            f"`{name}` {summary['count']}x, p50 {format_seconds(summary['p50'])}, "
+            f"p99 {format_seconds(summary['p99'])}, max {format_seconds(summary['max'])}"
+            for name, summary in rows
+        )
+    embed.set_footer(text=f"Event loop lag: {format_seconds(loop_lag.last_lag)}")
+
+    await ctx.send(embed=embed)
+
+
+@bot.command(name='stalls')
+@commands.has_permissions(administrator=True)
+async def show_stalls(ctx, count: int = 5):
+    """Show the most recent event loop stalls (Admin only)"""
+    if not watchdog.enabled:
+        await ctx.send("❌ The loop watchdog is off. Set LOOP_WATCHDOG=1 to enable it.")
+        return
+    stalls = list(watchdog.stalls)[-max(1, min(count, 10)):]
+
+    embed = discord.Embed(
+        title="🐢 Event Loop Stalls",
+        color=discord.Color.red()
+    )
+    if not stalls:
+        embed.description = f"No callbacks blocked longer than {1000 * watchdog.threshold:.0f}ms."
+    for stall in reversed(stalls):
+        # Innermost frames are where the time went
+        where = "\n".join(f"{os.path.basename(filename)}:{line} {name}"
+                          for filename, line, name in stall['stack'][-4:])
+        embed.add_field(
+            name=f"{format_seconds(stall['duration'])}{'+' if stall['ongoing'] else ''} in {stall['task']} "
+                 f"(<t:{int(stall['at'])}:R>)",
+            value=f"```{where[-1000:]}```",
+            inline=False
+        )
+    await ctx.send(embed=embed)
+
+
+@bot.command(name='loopprofile')
+@commands.has_permissions(administrator=True)
+async def loop_profile(ctx, seconds: int = 10):
+    """Sample the event loop for a few seconds and show where time goes (Admin only)"""
+    seconds = max(1, min(seconds, 60))
+    await ctx.send(f"⏳ Sampling the event loop for {seconds}s...")
+    collapsed, top = await watchdog.profile(seconds)
+
+    embed = discord.Embed(
+        title="🔬 Event Loop Profile",
+        color=discord.Color.purple()
+    )
+    embed.description = "\n".join(f"`{share:6.1%}` {function}" for function, share in top) or "No samples."
+    embed.set_footer(text="Full collapsed stacks attached (flamegraph format)")
+    await ctx.send(embed=embed, file=discord.File(io.BytesIO(collapsed.encode()), filename="loop-profile.txt"))
+
+
+@bot.command(name='cluster')
+@commands.has_permissions(administrator=True)
+async def cluster_status(ctx):
+    """Show every shard process in the cluster (Admin only)"""
+    await shard_status.report()
+    rows = await shard_status.cluster_status()
+
+    embed = discord.Embed(
+        title="🛰️ Cluster Status",
+        color=discord.Color.purple()
+    )
+    processes = {}
+    for row in rows:
+        processes.setdefault((row['cluster'], row['host'], row['pid']), []).append(row)
+    for (name, host, pid), shards in sorted(processes.items(), key=lambda item: item[1][0]['shard_id']):
+        down = all(row['stale'] for row in shards)
+        latencies = [row['latency_ms'] for row in shards if row['latency_ms'] is not None]
+        embed.add_field(
+            name=f"{'🔴' if down else '🟢'} {name} ({host}:{pid})",
+            value=f"Shards {', '.join(str(row['shard_id']) for row in shards)}\n"
+                  f"{sum(row['guilds'] for row in shards)} guilds, {sum(row['members'] for row in shards)} members\n"
+                  f"Latency {max(latencies) if latencies else '?'}ms, loop lag {shards[0]['loop_lag_ms']}ms, "
+                  f"DB in use {shards[0]['db_in_use']}",
+            inline=False
+        )
+    live = [row for row in rows if not row['stale']]
+    embed.description = (f"{len(live)}/{len(rows)} shards up, "
+                         f"{sum(row['guilds'] for row in live)} guilds, "
+                         f"{sum(row['members'] for row in live)} members")
     await ctx.send(embed=embed)
 
 
@@ -427,4 +919,7 @@ async def on_command_error(ctx, error):
 
 # Run the bot
 if __name__ == "__main__":
-    bot.run(os.getenv('DISCORD_TOKEN'))
\ No newline at end of file
+    try:
+        bot.run(os.getenv('DISCORD_TOKEN'))
+    finally:
+        db.close()
\ No newline at end of file
@@ -0,0 +1,215 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class PoolError(Exception):
+    """Raised when no connection frees up within the checkout timeout"""
+
+
+def connect_mysql_connector(config):
+    import mysql.connector
+    return mysql.connector.connect(**config)
+
+
+def _is_open(connection):
+    # PyMySQL's .open is a plain flag. mysql.connector's is_connected() pings the
+    # server, so its connections count as open until an error marks them broken.
+    return getattr(connection, 'open', True)
+
+
+class PooledConnection:
+    """A checked-out connection; close() hands it back to the pool instead of closing it"""
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+        self._returned = False
+        self.broken = False  # set when an error left the connection unusable
+        # name -> prepared cursor, lives as long as the underlying connection
+        self.statement_cache = pool.statement_caches.setdefault(id(connection), {})
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        if not self._returned:
+            self._returned = True
+            self._pool.release(self._connection, broken=self.broken)
+
+
+class ConnectionPool:
+    """Thread-safe MySQL pool that grows with checkout wait time and shrinks when idle.
+
+    A checkout takes an idle connection if there is one. Otherwise it waits
+    for a release, and once it has waited `grow_after` seconds opens a new
+    connection while below max_size; at max_size it waits up to `timeout`.
+    Connections idle longer than health_check_after are pinged before reuse,
+    and ones beyond min_size are closed after idle_timeout. Nothing talks to
+    the server while the pool's lock is held. `connect(config)` opens a
+    connection; mysql.connector by default, PyMySQL works as well.
+    """
+
+    def __init__(self, config, min_size=2, max_size=10, timeout=10.0, grow_after=0.05,
+                 idle_timeout=300.0, health_check_after=30.0, connect=connect_mysql_connector):
+        self.config = config
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.grow_after = grow_after
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self._idle = deque()  # (connection, released_at), most recent on the right
+        self._cond = threading.Condition()  # reentrant, so counters can be bumped from any method
+        self._last_reap = time.monotonic()
+        self.statement_caches = {}  # id(connection) -> {statement name: prepared cursor}
+        self.size = 0
+        self.in_use = 0
+        self.waiting = 0
+        # metrics
+        self.checkouts = 0
+        self.checkout_time = 0.0
+        self.max_checkout_time = 0.0
+        self.timeouts = 0
+        self.errors = 0
+        self.created = 0
+        self.closed = 0
+
+        for _ in range(min_size):
+            connection = self._connect()
+            self._idle.append((connection, time.monotonic()))
+            self.size += 1
+
+    def _connect(self):
+        connection = self.connect(self.config)
+        with self._cond:
+            self.created += 1
+        return connection
+
+    def _discard(self, connection):
+        """Close a connection the pool no longer counts; call without the lock held"""
+        self.statement_caches.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self._cond:
+            self.closed += 1
+
+    def get_connection(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        create = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    connection, released_at = self._idle.pop()
+                    break
+                now = time.monotonic()
+                can_grow = self.size < self.max_size
+                if can_grow and (self.size < self.min_size or now - started >= self.grow_after):
+                    self.size += 1
+                    create = True
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolError(f"No database connection free after {timeout:.1f}s "
+                                    f"({self.in_use}/{self.max_size} in use)")
+                if can_grow:
+                    remaining = min(remaining, max(0.0, started + self.grow_after - now))
+                self.waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_use += 1
+
+        try:
+            if create:
+                connection = self._connect()
+            elif time.monotonic() - released_at > self.health_check_after:
+                connection = self._check(connection)
+        except Exception:
+            with self._cond:
+                self.size -= 1
+                self.in_use -= 1
+                self.errors += 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self.checkouts += 1
+            self.checkout_time += elapsed
+            self.max_checkout_time = max(self.max_checkout_time, elapsed)
+        return PooledConnection(self, connection)
+
+    def _check(self, connection):
+        """Ping a connection that sat idle; replace it if the server dropped it"""
+        try:
+            connection.ping(reconnect=False)
+            return connection
+        except Exception:
+            logger.info("Dropping stale pooled database connection")
+            self._discard(connection)
+            return self._connect()
+
+    def release(self, connection, broken=False):
+        """Hand a connection back; broken ones (or ones PyMySQL saw close) are dropped"""
+        if broken or not _is_open(connection):
+            self._discard(connection)
+            with self._cond:
+                self.in_use -= 1
+                self.size -= 1
+                self.errors += 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self.in_use -= 1
+            self._idle.append((connection, time.monotonic()))
+            expired = self._reap()
+            self._cond.notify()
+        for connection in expired:
+            self._discard(connection)
+
+    def _reap(self):
+        """Take connections idle past idle_timeout while above min_size out of the pool (lock held)"""
+        now = time.monotonic()
+        if now - self._last_reap < self.idle_timeout / 4:
+            return []
+        self._last_reap = now
+        expired = []
+        while self._idle and self.size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            connection, _ = self._idle.popleft()
+            self.size -= 1
+            expired.append(connection)
+        return expired
+
+    def close(self):
+        with self._cond:
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self.size -= len(idle)
+        for connection in idle:
+            self._discard(connection)
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'in_use': self.in_use,
+            'idle': len(self._idle),
+            'waiting': self.waiting,
+            'checkouts': self.checkouts,
+            'avg_checkout_ms': 1000 * self.checkout_time / self.checkouts if self.checkouts else 0.0,
+            'max_checkout_ms': 1000 * self.max_checkout_time,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'created': self.created,
+            'closed': self.closed,
+        }
@@ -0,0 +1,112 @@
+# Every DML statement the bot runs, named once.
+#
+# Single-row statements on hot paths run as server-side prepared statements
+# (DatabaseManager.prepared_query / prepared_update, cached per connection).
+# Batched writes pass the text to executemany, which mysql-connector rewrites
+# into one multi-row INSERT - faster than executing a prepared statement per row.
+
+STATEMENTS = {
+    # users
+    'select_user': "SELECT * FROM users WHERE user_id = %s",
+    'insert_member': """INSERT IGNORE INTO users (user_id, username, display_name)
+                        VALUES (%s, %s, %s)""",
+    'upsert_member': """INSERT INTO users (user_id, username, display_name)
+                        VALUES (%s, %s, %s)
+                        ON DUPLICATE KEY UPDATE
+                        username = VALUES(username),
+                        display_name = VALUES(display_name)""",
+    'upsert_user_names': """INSERT INTO users (user_id, username, display_name)
+                            VALUES (%s, %s, %s)
+                            ON DUPLICATE KEY UPDATE
+                            username = VALUES(username),
+                            display_name = COALESCE(VALUES(display_name), display_name)""",
+    # {users} is filled with one %s per user ID
+    'load_known_users': "SELECT user_id, username, display_name FROM users WHERE user_id IN ({users})",
+
+    # guilds
+    'insert_guild': "INSERT IGNORE INTO guilds (guild_id, guild_name) VALUES (%s, %s)",
+    'load_known_guilds': "SELECT guild_id FROM guilds",
+    # {shards} is filled with one %s per local shard ID
+    'load_known_guilds_for_shards': "SELECT guild_id FROM guilds WHERE MOD(guild_id >> 22, %s) IN ({shards})",
+    'load_guild_prefixes': """SELECT guild_id, prefix FROM guilds
+                              WHERE prefix IS NOT NULL AND prefix <> %s""",
+    'load_guild_prefixes_for_shards': """SELECT guild_id, prefix FROM guilds
+                                         WHERE prefix IS NOT NULL AND prefix <> %s
+                                         AND MOD(guild_id >> 22, %s) IN ({shards})""",
+    'select_guild_prefix': "SELECT prefix FROM guilds WHERE guild_id = %s",
+    'set_guild_prefix': """INSERT INTO guilds (guild_id, guild_name, prefix)
+                           VALUES (%s, %s, %s)
+                           ON DUPLICATE KEY UPDATE prefix = VALUES(prefix)""",
+
+    # points
+    'add_points': """INSERT INTO users (user_id, username, display_name, points)
+                     VALUES (%s, %s, %s, %s)
+                     ON DUPLICATE KEY UPDATE points = points + VALUES(points)""",
+    'add_guild_points': """INSERT INTO guild_points (guild_id, user_id, points)
+                           VALUES (%s, %s, %s)
+                           ON DUPLICATE KEY UPDATE points = points + VALUES(points)""",
+    'load_user_points': "SELECT user_id, username, points FROM users WHERE points <> 0",
+    'load_user_points_since': "SELECT user_id, username, points FROM users WHERE updated_at >= %s",
+    'load_guild_points': "SELECT guild_id, user_id, points FROM guild_points WHERE points <> 0",
+    # {shards} is filled with one %s per local shard ID
+    'load_guild_points_for_shards': """SELECT guild_id, user_id, points FROM guild_points
+                                       WHERE points <> 0 AND MOD(guild_id >> 22, %s) IN ({shards})""",
+
+    # activity
+    'insert_activity': """INSERT INTO activity_log (user_id, guild_id, activity_type, amount, created_at)
+                          VALUES (%s, %s, %s, %s, %s)""",
+    'rollup_activity': """INSERT INTO activity_daily (day, guild_id, user_id, activity_type, events, amount)
+                          VALUES (%s, %s, %s, %s, %s, %s)
+                          ON DUPLICATE KEY UPDATE
+                          events = events + VALUES(events),
+                          amount = amount + VALUES(amount)""",
+    'activity_history': """SELECT day, activity_type, events, amount
+                           FROM activity_daily
+                           WHERE guild_id = %s AND user_id = %s AND day >= %s
+                           ORDER BY day DESC""",
+
+    # write-behind buffer bookkeeping
+    'mark_batch_applied': "INSERT INTO write_batches (batch_id) VALUES (%s)",
+    'select_batch_applied': "SELECT 1 FROM write_batches WHERE batch_id = %s",
+    # batches applied one write at a time commit as '<batch_id>-<n>'
+    'select_op_batches_applied': "SELECT batch_id FROM write_batches WHERE batch_id LIKE %s",
+    # ids are time_ns() strings of equal length, so they sort by age
+    'prune_batches_applied': """DELETE FROM write_batches
+                                WHERE batch_id < %s AND applied_at < NOW() - INTERVAL %s DAY""",
+
+    # sharding
+    'upsert_shard_status': """INSERT INTO shard_status (shard_id, shard_count, cluster, host, pid, guilds,
+                                                        members, latency_ms, loop_lag_ms, db_in_use, started_at)
+                              VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                              ON DUPLICATE KEY UPDATE
+                              shard_count = VALUES(shard_count), cluster = VALUES(cluster),
+                              host = VALUES(host), pid = VALUES(pid), guilds = VALUES(guilds),
+                              members = VALUES(members), latency_ms = VALUES(latency_ms),
+                              loop_lag_ms = VALUES(loop_lag_ms), db_in_use = VALUES(db_in_use),
+                              started_at = VALUES(started_at), updated_at = CURRENT_TIMESTAMP""",
+    'prune_shard_status': """DELETE FROM shard_status
+                             WHERE shard_id >= %s OR updated_at < NOW() - INTERVAL %s SECOND""",
+    'database_now': "SELECT NOW() AS now",
+    'load_shard_status': """SELECT *, TIMESTAMPDIFF(SECOND, updated_at, NOW()) AS age
+                            FROM shard_status ORDER BY shard_id""",
+
+    # stats: one pass over users plus a count of guilds
+    'reconcile_stats': """SELECT COUNT(*) AS users,
+                                 COALESCE(SUM(points), 0) AS total_points,
+                                 COALESCE(SUM(points > 0), 0) AS active_users,
+                                 (SELECT COUNT(*) FROM guilds) AS guilds
+                          FROM users""",
+}
+
+# statement text -> name, for labelling timings of statements run by text
+STATEMENT_NAMES = {text: name for name, text in STATEMENTS.items()}
+
+
+def statement_label(statement):
+    """Metrics label for a statement name or text: its registry name, else its first words"""
+    if statement in STATEMENTS:
+        return statement
+    name = STATEMENT_NAMES.get(statement)
+    if name is not None:
+        return name
+    return ' '.join(statement.split()[:4])
@@ -0,0 +1,74 @@
+import logging
+
+from db_statements import STATEMENTS
+
+logger = logging.getLogger(__name__)
+
+MAX_PREFIX_LENGTH = 10  # guilds.prefix is VARCHAR(10)
+
+
+class GuildPrefixes:
+    """Per-guild command prefixes served from memory.
+
+    The map is loaded once at startup and updated by set(), so resolving a
+    prefix for a message is a dict lookup. Only guilds that changed their
+    prefix are kept; everyone else falls back to the default.
+    """
+
+    def __init__(self, db, default='!'):
+        self.db = db
+        self.default = default
+        self.prefixes = {}  # guild_id -> prefix, non-default only
+
+    async def load(self, shard_ids=None, shard_count=None):
+        """Load custom prefixes; with shard_ids only for guilds on those shards"""
+        if shard_ids is None:
+            rows = await self.db.query(STATEMENTS['load_guild_prefixes'], (self.default,)) or []
+        else:
+            query = STATEMENTS['load_guild_prefixes_for_shards'].format(shards=", ".join(["%s"] * len(shard_ids)))
+            rows = await self.db.query(query, (self.default, shard_count, *shard_ids)) or []
+        self.prefixes = {row['guild_id']: row['prefix'] for row in rows}
+        logger.info(f"Loaded custom prefixes for {len(self.prefixes)} guilds")
+
+    async def load_guild(self, guild_id):
+        """Reload one guild's stored prefix, e.g. when the bot rejoins it"""
+        rows = await self.db.prepared_query('select_guild_prefix', (guild_id,))
+        prefix = rows[0]['prefix'] if rows else None
+        if prefix is not None and prefix != self.default:
+            self.prefixes[guild_id] = prefix
+
+    def get(self, guild_id):
+        return self.prefixes.get(guild_id, self.default)
+
+    def __call__(self, bot, message):
+        """command_prefix callable; never touches the database"""
+        guild = message.guild
+        if guild is None:
+            return self.default
+        return self.prefixes.get(guild.id, self.default)
+
+    @staticmethod
+    def validate(prefix):
+        """Return an error message for an unusable prefix, or None"""
+        if not prefix or len(prefix) > MAX_PREFIX_LENGTH:
+            return f"Prefix must be 1-{MAX_PREFIX_LENGTH} characters."
+        if any(char.isspace() for char in prefix):
+            return "Prefix can't contain spaces."
+        return None
+
+    async def set(self, guild_id, guild_name, prefix):
+        """Store a guild's prefix; the in-memory map only changes once the write succeeds"""
+        # NULL follows DEFAULT_PREFIX, even if it changes later
+        stored = None if prefix == self.default else prefix
+        # A transaction reports failure explicitly; an unchanged upsert also affects 0 rows
+        if not await self.db.transaction([(STATEMENTS['set_guild_prefix'], [(guild_id, guild_name, stored)])]):
+            return False
+        if prefix == self.default:
+            self.prefixes.pop(guild_id, None)
+        else:
+            self.prefixes[guild_id] = prefix
+        return True
+
+    def forget(self, guild_id):
+        """Drop a guild the bot left from memory; its stored prefix stays for load_guild()"""
+        self.prefixes.pop(guild_id, None)
@@ -0,0 +1,149 @@
+"""Runs a bot as several processes, each owning a contiguous range of shards.
+
+    python launcher.py db --processes 4 [--shards 16] [--pool-max 40]
+    python launcher.py main --processes 2
+
+Without --shards the total is Discord's recommendation for the token.
+Workers get SHARD_COUNT, SHARD_IDS and CLUSTER_ID, plus their share of
+--pool-max as DB_POOL_MAX, their share of the Steam rate limit
+(STEAM_RATE_LIMIT / STEAM_RATE_BURST) and a per-worker metrics port.
+Workers that exit are restarted with backoff; Ctrl+C / SIGTERM stops them
+all.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s launcher %(levelname)s %(message)s')
+logger = logging.getLogger(__name__)
+
+BOTS = {'db': 'db.py', 'main': 'main.py'}
+METRICS_PORT_VARS = {'db': 'DB_METRICS_PORT', 'main': 'STEAM_METRICS_PORT'}
+
+
+def recommended_shards(token):
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={'Authorization': f"Bot {token}", 'User-Agent': 'DiscordBot (launcher, 1.0)'},
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)['shards']
+
+
+def shard_ranges(shard_count, processes):
+    """Split 0..shard_count-1 into `processes` contiguous, near-equal ranges"""
+    processes = min(processes, shard_count)
+    base, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        size = base + (1 if i < extra else 0)
+        ranges.append((start, start + size - 1))
+        start += size
+    return ranges
+
+
+class Worker:
+    def __init__(self, bot, index, first, last, env):
+        self.bot = bot
+        self.name = f"{bot}-{index}"
+        self.shards = f"{first}-{last}"
+        self.env = env
+        self.process = None
+        self.restarts = 0
+        self.started_at = 0.0
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.process = subprocess.Popen([sys.executable, BOTS[self.bot]], env=self.env,
+                                        cwd=os.path.dirname(os.path.abspath(__file__)))
+        logger.info(f"Started {self.name} (shards {self.shards}, pid {self.process.pid})")
+
+
+def worker_env(args, index, first, last, shard_count, processes):
+    env = dict(os.environ)
+    env['SHARD_COUNT'] = str(shard_count)
+    env['SHARD_IDS'] = f"{first}-{last}"
+    env['CLUSTER_ID'] = f"{args.bot}-{index}"
+    if args.pool_max:
+        # The database connection budget is shared by all workers
+        env['DB_POOL_MAX'] = str(max(2, args.pool_max // processes))
+        env['DB_POOL_MIN'] = str(min(int(env.get('DB_POOL_MIN', 2)), int(env['DB_POOL_MAX'])))
+    if args.bot == 'main':
+        # The Steam key's quota is shared too; these fall back to steam_api's defaults
+        env['STEAM_RATE_LIMIT'] = str(float(os.getenv('STEAM_RATE_LIMIT', 1.1)) / processes)
+        env['STEAM_RATE_BURST'] = str(max(1, int(os.getenv('STEAM_RATE_BURST', 25)) // processes))
+    port_var = METRICS_PORT_VARS[args.bot]
+    if os.getenv(port_var):
+        env[port_var] = str(int(os.environ[port_var]) + index)
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a bot sharded across processes")
+    parser.add_argument('bot', choices=sorted(BOTS))
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shards', type=int, help="total shard count (default: Discord's recommendation)")
+    parser.add_argument('--pool-max', type=int, help="database connections across all workers")
+    parser.add_argument('--stagger', type=float, default=5.0, help="seconds between worker starts")
+    args = parser.parse_args()
+
+    shard_count = args.shards or recommended_shards(os.environ['DISCORD_TOKEN'])
+    ranges = shard_ranges(shard_count, args.processes)
+    logger.info(f"Running {args.bot} with {shard_count} shards across {len(ranges)} processes")
+    workers = [Worker(args.bot, i, first, last, worker_env(args, i, first, last, shard_count, len(ranges)))
+               for i, (first, last) in enumerate(ranges)]
+
+    # Every wait below is on this event, so a stop request never sits behind a restart backoff
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for i, worker in enumerate(workers):
+        worker.start()
+        # Shards identify one at a time per ~5s; don't have every process hit the gateway at once
+        if i < len(workers) - 1 and stopping.wait(args.stagger):
+            break
+
+    while not stopping.wait(1):
+        for worker in workers:
+            if worker.process is None or worker.process.poll() is None:
+                continue
+            code = worker.process.returncode
+            # Back off when a worker keeps dying right after starting
+            ran_for = time.monotonic() - worker.started_at
+            worker.restarts = 0 if ran_for > 300 else worker.restarts + 1
+            delay = min(60, 2 ** worker.restarts)
+            logger.warning(f"{worker.name} exited with {code} after {ran_for:.0f}s; restarting in {delay}s")
+            if stopping.wait(delay):
+                break
+            worker.start()
+
+    logger.info("Stopping workers")
+    workers = [worker for worker in workers if worker.process is not None]
+    for worker in workers:
+        if worker.process.poll() is None:
+            worker.process.send_signal(signal.SIGINT)
+    for worker in workers:
+        try:
+            worker.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            worker.process.kill()
+
+
+if __name__ == "__main__":
+    main()
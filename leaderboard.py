@@ -0,0 +1,156 @@
+import asyncio
+import bisect
+import datetime
+import logging
+from collections import defaultdict
+
+from db_statements import STATEMENTS
+
+logger = logging.getLogger(__name__)
+
+# Seconds of users.updated_at each incremental refresh re-reads
+WATERMARK_OVERLAP = 30
+
+
+class Leaderboard:
+    """Users ordered by points, highest first, ties broken by user ID.
+
+    Kept as a sorted list searched with bisect: rank and top-N lookups are
+    O(log n), and an update is an O(log n) search plus a memmove.
+    """
+
+    def __init__(self):
+        self._order = []  # sorted (-points, user_id)
+        self._points = {}  # user_id -> points
+
+    def __len__(self):
+        return len(self._order)
+
+    @classmethod
+    def build(cls, points):
+        """Build from {user_id: points} with one sort instead of n inserts"""
+        board = cls()
+        board._points = {user_id: p for user_id, p in points.items() if p}
+        board._order = sorted((-p, user_id) for user_id, p in board._points.items())
+        return board
+
+    def set(self, user_id, points):
+        old = self._points.get(user_id)
+        if old is not None:
+            del self._order[bisect.bisect_left(self._order, (-old, user_id))]
+        if points:
+            self._points[user_id] = points
+            bisect.insort(self._order, (-points, user_id))
+        else:
+            self._points.pop(user_id, None)
+
+    def add(self, user_id, delta):
+        self.set(user_id, self._points.get(user_id, 0) + delta)
+
+    def points(self, user_id):
+        return self._points.get(user_id, 0)
+
+    def top(self, n):
+        """Return [(user_id, points), ...] for the n highest scores"""
+        return [(user_id, -neg_points) for neg_points, user_id in self._order[:n]]
+
+    def rank(self, user_id):
+        """1-based rank, or None if the user has no points here"""
+        points = self._points.get(user_id)
+        if points is None:
+            return None
+        return bisect.bisect_left(self._order, (-points, user_id)) + 1
+
+
+class Leaderboards:
+    """Global and per-guild leaderboards, loaded once and updated as points change"""
+
+    def __init__(self, db):
+        self.db = db
+        self.global_board = Leaderboard()
+        self.guild_boards = defaultdict(Leaderboard)
+        self.usernames = {}
+        self.loaded = False
+        self.watermark = None  # database time the next incremental refresh reads users from
+        self._task = None
+
+    async def load(self, shard_ids=None, shard_count=None):
+        """Build the boards from users and guild_points.
+
+        With shard_ids, only guilds on those shards get a board: a guild's
+        points only ever change in the process running its shard.
+        """
+        now = await self.db.query(STATEMENTS['database_now'])
+        users = await self.db.query(STATEMENTS['load_user_points'])
+        if shard_ids is None:
+            guild_points = await self.db.query(STATEMENTS['load_guild_points'])
+        else:
+            query = STATEMENTS['load_guild_points_for_shards'].format(shards=", ".join(["%s"] * len(shard_ids)))
+            guild_points = await self.db.query(query, (shard_count, *shard_ids))
+        if now is None or users is None or guild_points is None:
+            raise RuntimeError("Couldn't load leaderboards from the database")
+
+        per_guild = defaultdict(dict)
+        for row in guild_points:
+            per_guild[row['guild_id']][row['user_id']] = row['points']
+
+        self.global_board = Leaderboard.build({row['user_id']: row['points'] for row in users})
+        self.guild_boards = defaultdict(Leaderboard, {
+            guild_id: Leaderboard.build(points) for guild_id, points in per_guild.items()
+        })
+        self.usernames = {row['user_id']: row['username'] for row in users}
+        self.watermark = now[0]['now'] - datetime.timedelta(seconds=WATERMARK_OVERLAP)
+        self.loaded = True
+        logger.info(f"Leaderboards loaded: {len(self.global_board)} users, {len(self.guild_boards)} guilds")
+
+    async def refresh_global(self, buffer):
+        """Apply users rows changed since the last refresh, picking up other shards' points.
+
+        Rows come back with their committed points; `buffer` (the
+        WriteBehindBuffer) adds this process's unflushed ones. A refresh that
+        overlaps a flush is skipped, or the flushed batch would count twice.
+        """
+        version = buffer.flush_version
+        rows = await self.db.query(STATEMENTS['database_now'])
+        users = await self.db.query(STATEMENTS['load_user_points_since'], (self.watermark,))
+        if rows is None or users is None:
+            logger.warning("Global leaderboard refresh failed; keeping the current board")
+            return
+        if version % 2 or version != buffer.flush_version:
+            return
+        for row in users:
+            self.global_board.set(row['user_id'], row['points'] + buffer.unflushed_points(row['user_id']))
+            self.usernames[row['user_id']] = row['username']
+        # Rows committed late can carry a timestamp a little before NOW(); re-reading them is harmless
+        self.watermark = rows[0]['now'] - datetime.timedelta(seconds=WATERMARK_OVERLAP)
+
+    def start_refresh(self, interval, buffer):
+        """Refresh the global board every `interval` seconds"""
+        self._task = asyncio.create_task(self._refresh_periodically(interval, buffer))
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _refresh_periodically(self, interval, buffer):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh_global(buffer)
+            except Exception as e:
+                logger.error(f"Global leaderboard refresh failed: {e}")
+
+    def add_points(self, guild_id, user_id, amount, username):
+        self.usernames[user_id] = username
+        self.global_board.add(user_id, amount)
+        if guild_id is not None:
+            self.guild_boards[guild_id].add(user_id, amount)
+
+    def rename(self, user_id, username):
+        if user_id in self.usernames:
+            self.usernames[user_id] = username
+
+    def board(self, guild_id=None):
+        if guild_id is None:
+            return self.global_board
+        return self.guild_boards.get(guild_id) or Leaderboard()
@@ -0,0 +1,176 @@
+import asyncio
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+def _stack(frame, limit=30):
+    """(filename, line, function) tuples for a frame, outermost first"""
+    return [(f.filename, f.lineno, f.name) for f in traceback.extract_stack(frame, limit=limit)]
+
+
+def _format_stack(stack):
+    return "".join(f'  File "{filename}", line {line}, in {name}\n' for filename, line, name in stack)
+
+
+class LoopWatchdog:
+    """Watches the event loop from a helper thread and reports stalls.
+
+    A heartbeat task stamps the time every `interval`; when the stamp is
+    older than `threshold` the loop is stuck in one callback, so the thread
+    grabs the loop thread's stack and the running task's name. Commands and
+    events rename their task (see DatabaseBot.invoke, TimedCommandTree), so a
+    stall is attributed to what was running.
+
+    profile() samples the loop thread's stack for a while without stopping
+    anything and returns collapsed stacks (flamegraph format); it works
+    whether or not stall detection is enabled. Samples can only be taken
+    when the loop thread lets go of the GIL, so blocking I/O shows up
+    accurately while pure-Python hot loops are under-counted.
+    """
+
+    def __init__(self, threshold=0.25, enabled=False, interval=0.05, keep=50, metrics=None,
+                 profile_dir='.'):
+        self.threshold = threshold
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.interval = interval
+        self.metrics = metrics
+        self.stalls = collections.deque(maxlen=keep)
+        self.loop = None
+        self._loop_thread = None
+        self._beat = 0.0
+        self._reported_beat = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Attach to the running loop (call from the loop); watch it for stalls if enabled"""
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._install_signal_handler()
+        if not self.enabled:
+            return
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        logger.info(f"Loop watchdog reporting callbacks blocking longer than {1000 * self.threshold:.0f}ms")
+
+    def close(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            beat = time.monotonic()
+            # The previous beat's stall (if any) is over; record how long it really was
+            if self.stalls and self.stalls[-1]['ongoing']:
+                stall = self.stalls[-1]
+                stall['duration'] = beat - self._beat - self.interval
+                stall['ongoing'] = False
+                logger.warning(f"Event loop unblocked after {1000 * stall['duration']:.0f}ms ({stall['task']})")
+                if self.metrics is not None:
+                    self.metrics.observe('loop', 'stall', stall['duration'])
+            self._beat = beat
+            await asyncio.sleep(self.interval)
+
+    def _current_task_name(self):
+        try:
+            task = asyncio.current_task(self.loop)
+        except RuntimeError:
+            return None
+        return task.get_name() if task is not None else None
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold or beat == self._reported_beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = _stack(frame)
+            del frame
+            self._reported_beat = beat
+            stall = {
+                'at': time.time(),
+                'duration': blocked,
+                'ongoing': True,
+                'task': self._current_task_name() or 'callback',
+                'stack': stack,
+            }
+            self.stalls.append(stall)
+            logger.warning(f"Event loop blocked for {1000 * blocked:.0f}ms+ in {stall['task']}:\n"
+                           f"{_format_stack(stack)}")
+
+    def _sample(self, seconds, sample_interval):
+        counts = collections.Counter()
+        deadline = time.monotonic() + seconds
+        samples = 0
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                counts[";".join(f"{name} ({os.path.basename(filename)}:{line})"
+                                for filename, line, name in _stack(frame, limit=60))] += 1
+                del frame
+                samples += 1
+            time.sleep(sample_interval)
+        return counts, samples
+
+    async def profile(self, seconds=10.0, sample_interval=0.005):
+        """Sample the loop thread's stack for `seconds`.
+
+        Returns (collapsed_stacks_text, [(function, share of samples)] by self time);
+        time spent waiting in the selector shows up as '<idle>'.
+        """
+        counts, samples = await asyncio.to_thread(self._sample, seconds, sample_interval)
+        collapsed = "\n".join(f"{stack} {count}" for stack, count in counts.most_common())
+        leaves = collections.Counter()
+        for stack, count in counts.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            leaves['<idle>' if '(selectors.py:' in leaf else leaf] += count
+        top = [(function, count / samples) for function, count in leaves.most_common(15)] if samples else []
+        return collapsed, top
+
+    @staticmethod
+    def _write(path, text):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def _install_signal_handler(self, seconds=10.0):
+        """Dump a profile to profile_dir whenever the process gets SIGUSR1 (Unix only)"""
+        signum = getattr(signal, 'SIGUSR1', None)
+        if signum is None:
+            return
+
+        async def dump():
+            collapsed, _ = await self.profile(seconds)
+            path = os.path.join(self.profile_dir, f"loop-profile-{int(time.time())}.txt")
+            await asyncio.to_thread(self._write, path, collapsed + "\n")
+            logger.warning(f"Wrote event loop profile to {path}")
+
+        try:
+            self.loop.add_signal_handler(signum, lambda: asyncio.ensure_future(dump()))
+        except (NotImplementedError, RuntimeError):
+            pass
+
+
+def from_env(metrics=None):
+    """LoopWatchdog configured from LOOP_WATCHDOG (opt-in), LOOP_WATCHDOG_MS and LOOP_PROFILE_DIR"""
+    return LoopWatchdog(
+        threshold=int(os.getenv('LOOP_WATCHDOG_MS', 250)) / 1000,
+        enabled=os.getenv('LOOP_WATCHDOG', '').lower() in ('1', 'true', 'yes'),
+        metrics=metrics,
+        profile_dir=os.getenv('LOOP_PROFILE_DIR', '.'),
+    )
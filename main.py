@@ -1,65 +1,198 @@
+import asyncio
 import discord
+from discord import app_commands
 from discord.ext import commands
 import logging
 import os
-import requests
-import pymysql
+import time
+
+import loop_watchdog
+from metrics import LoopLagMonitor, MetricsServer, format_seconds, metrics
+from member_index import cache_options
+from steam_api import SteamAPIError, SteamBusyError, SteamClient, SteamRateLimitedError, VanityResolver
+from steam_links import LinkedAccounts
+from steam_prefetch import PREFETCH_BUDGET, Prefetcher
+from sharding import shard_config
+from steam_store import SteamStore
 
 
 
 # ---------- ENVIRONMENT VARIABLES ----------
 token = os.getenv('DISCORD_TOKEN')
 steam_api_key = os.getenv('STEAM_API_KEY')
-STEAM_API_BASE = "https://api.steampowered.com"
-
-# db setup
-
-try:
-    connection = pymysql.connect(
-        host=os.getenv('MYSQLHOST'),
-        port=int(os.getenv('MYSQLPORT')),
-        user=os.getenv('MYSQLUSER'),
-        password=os.getenv('MYSQLPASSWORD'),
-        db=os.getenv('MYSQLDATABASE'),
-    )
-    print("Connection established")
-    connection.close()
-    print("Connection closed")
-except Exception as e:
-    print(e)
 
 
 # ---------- LOGGING ----------
-handler = logging.FileHandler(filename='.venv/discord.log', encoding='utf-8', mode='w')
-logging.basicConfig(level=logging.DEBUG, handlers=[handler])
+# DEBUG logs every gateway event, which costs real time on busy shards; opt in with LOG_LEVEL=DEBUG
+log_level = getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper(), logging.INFO)
+handler = logging.FileHandler(filename=os.getenv('LOG_FILE', '.venv/discord.log'), encoding='utf-8', mode='w')
+logging.basicConfig(level=log_level, handlers=[handler])
 
 # ---------- DISCORD BOT SETUP ----------
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 intents.messages = True
-bot = commands.Bot(command_prefix='/', intents=intents)
+
+shard_count, shard_ids, _ = shard_config()
+
+# One shared Steam client: its HTTP session is opened in setup_hook and closed on shutdown
+steam = SteamClient(steam_api_key)
+steam_store = SteamStore.from_env()
+vanity = VanityResolver(steam, steam_store)
+# Refreshes popular apps and profiles in the background; its warm set lives in steam_warm.
+# Every process prefetches for its own shards, so each gets its shards' share of the budget.
+prefetcher = Prefetcher(steam, steam_store, budget=PREFETCH_BUDGET * (
+    len(shard_ids) / shard_count if shard_ids is not None else 1))
+# Discord user -> Steam account links, with every linked account snapshotted on a schedule
+accounts = LinkedAccounts(steam, steam_store)
+
+loop_lag = LoopLagMonitor(metrics)
+watchdog = loop_watchdog.from_env(metrics)
+metrics_port = os.getenv('STEAM_METRICS_PORT')
+metrics_server = MetricsServer(metrics, int(metrics_port)) if metrics_port else None
+# Token bucket state: queue depth, tokens left, average and worst wait for a slot
+metrics.register_gauges('steam_ratelimit', steam.limiter.stats)
+
+
+class TimedCommandTree(app_commands.CommandTree):
+    """Records slash command latency from dispatch to completion or error"""
+
+    async def interaction_check(self, interaction):
+        interaction.extras['started'] = time.perf_counter()
+        if interaction.command is not None:
+            # Lets the loop watchdog attribute stalls to the command
+            asyncio.current_task().set_name(f"command:{interaction.command.qualified_name}")
+        return True
+
+    def record(self, interaction, command):
+        started = interaction.extras.get('started')
+        if started is not None and command is not None:
+            metrics.observe('command', command.qualified_name, time.perf_counter() - started)
+
+    async def on_error(self, interaction, error):
+        self.record(interaction, interaction.command)
+        await super().on_error(interaction, error)
+
+
+class SteamBot(commands.AutoShardedBot):
+    async def setup_hook(self):
+        loop_lag.start()
+        watchdog.start()
+        if metrics_server is not None:
+            await metrics_server.start()
+        await steam.start()
+        try:
+            await steam_store.start()
+        except Exception as e:
+            logging.error(f"Steam database unavailable, vanity names won't be persisted: {e}")
+            vanity.store = None
+            prefetcher.store = None
+            accounts.store = None
+        await prefetcher.start()
+        if accounts.available:
+            # One sweep per deployment: the process running shard 0 does it
+            accounts.start(sweep=shard_ids is None or 0 in shard_ids)
+
+    async def close(self):
+        await super().close()
+        accounts.close()
+        await prefetcher.close()
+        await steam.close()
+        await steam_store.close()
+        loop_lag.close()
+        watchdog.close()
+        if metrics_server is not None:
+            await metrics_server.close()
+
+
+# Slash commands get their members resolved in the interaction, so nothing needs the member cache
+bot = SteamBot(command_prefix='/', intents=intents, tree_cls=TimedCommandTree,
+               shard_count=shard_count, shard_ids=shard_ids,
+               **cache_options(os.getenv('MEMBER_CACHE', 'lean'), intents))
 
 # ---------- HELPER FUNCTIONS ----------
 async def resolve_steam_id(steam_id_or_vanity):
     """Resolve vanity URL to SteamID64, or return SteamID64 if already numeric."""
     if steam_id_or_vanity.isdigit():
         return steam_id_or_vanity
-    url = f"{STEAM_API_BASE}/ISteamUser/ResolveVanityURL/v1/"
-    params = {'key': steam_api_key, 'vanityurl': steam_id_or_vanity}
     try:
-        resp = requests.get(url, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        if data['response']['success'] != 1:
-            return None
-        return data['response']['steamid']
+        return await vanity.resolve(steam_id_or_vanity)
+    except (SteamBusyError, SteamRateLimitedError):
+        raise
     except Exception:
         return None
 
+
+def steam_error_message(error, what):
+    """User-facing text for a failed Steam command (call from inside the except block)"""
+    if isinstance(error, SteamBusyError):
+        return "⏳ Too many Steam lookups right now, please try again in a few seconds."
+    if isinstance(error, SteamRateLimitedError):
+        return "⏳ Steam is rate limiting the bot, please try again in a minute."
+    if isinstance(error, SteamAPIError):
+        return f"Error fetching {what}: {error}"
+    logging.exception(f"Unexpected error fetching {what}")
+    return f"Error fetching {what}."
+
+
+async def command_steam_id(interaction, steam_id):
+    """The SteamID64 a command is about: the argument, or else the caller's linked account.
+
+    Answers the deferred interaction and returns None when there's neither.
+    """
+    if steam_id is None:
+        linked = await accounts.get(interaction.user.id) if accounts.available else None
+        if linked is None:
+            await interaction.edit_original_response(
+                content="No Steam account linked. Pass a Steam ID or vanity URL, or link yours with /steam_link.")
+        return linked
+    resolved = await resolve_steam_id(steam_id)
+    if not resolved:
+        await interaction.edit_original_response(content="Invalid Steam ID or vanity URL.")
+    return resolved
+
+
+async def local_copy(peek, steam_id, part):
+    """The freshest local data for a command: the in-process cache if current, else the account snapshot.
+
+    Returns (cached, snapshot_age): cached in the form respond_progressively
+    takes, snapshot_age set only when a current snapshot is being served.
+    """
+    if (peek is not None and peek[1]) or not accounts.available:
+        return peek, None
+    try:
+        snapshot = await accounts.snapshot(steam_id, part)
+    except Exception as e:
+        logging.error(f"Error reading the Steam snapshot of {steam_id}: {e}")
+        return peek, None
+    if snapshot is None:
+        return peek, None
+    value, current, age = snapshot
+    if current:
+        return (value, True), age
+    return (peek if peek is not None else (value, False)), None
+
+
+def snapshot_render(render, age):
+    """Wrap an embed builder to note the snapshot's age in the footer (age None: unchanged)"""
+    if age is None:
+        return render
+
+    def render_snapshot(value):
+        embed = render(value)
+        embed.set_footer(text=f"Snapshot from {max(1, age // 60)} min ago")
+        return embed
+    return render_snapshot
+
 # ---------- EVENTS ----------
 @bot.event
+@metrics.timed('event')
 async def on_ready():
+    # Commands are global, so only the process running shard 0 syncs them
+    if shard_ids is not None and 0 not in shard_ids:
+        print(f'Bot is ready: {bot.user.name} (shards {shard_ids})')
+        return
     try:
         synced = await bot.tree.sync()
         print(f"✅ Synced {len(synced)} slash commands")
@@ -71,111 +204,231 @@ async def on_ready():
     except Exception as e:
         print(f"❌ Failed to sync commands: {e}")
     print(f'Bot is ready: {bot.user.name}')
-    # Resume tracking users from DB
 
 @bot.event
+@metrics.timed('event')
 async def on_message(message):
     if message.author == bot.user:
         return
     await bot.process_commands(message)
 
+
+@bot.event
+async def on_app_command_completion(interaction, command):
+    bot.tree.record(interaction, command)
+
 # ---------- COMMANDS ----------
 
 
+def user_embed(user):
+    embed = discord.Embed(
+        title=f"Steam Profile: {user.get('personaname', 'Unknown')}",
+        color=0x1b2838
+    )
+    embed.add_field(name="Steam ID", value=user.get('steamid', 'Unknown'), inline=True)
+    embed.add_field(
+        name="Profile State",
+        value="Public" if user.get('communityvisibilitystate', 1) == 3 else "Private",
+        inline=True
+    )
+    embed.add_field(name="Profile Created", value=user.get('timecreated', 'Unknown'), inline=True)
+    embed.add_field(name="Profile URL", value=user.get('profileurl', 'Unknown'), inline=False)
+    if 'avatarfull' in user:
+        embed.set_thumbnail(url=user['avatarfull'])
+    return embed
+
+
+def games_embed(games):
+    embed = discord.Embed(title="Recently Played Games", color=0x1b2838)
+    for game in games[:5]:
+        total_hours = round(game['playtime_forever'] / 60, 1)
+        recent_hours = round(game.get('playtime_2weeks', 0)/60, 1)
+        embed.add_field(
+            name=game['name'],
+            value=f"Total: {total_hours}h\nRecent: {recent_hours}h",
+            inline=True
+        )
+    return embed
+
+
+def game_embed(game):
+    embed = discord.Embed(
+        title=game['name'],
+        description=game.get('short_description', 'No description available')[:500],
+        color=0x1b2838
+    )
+    if 'header_image' in game:
+        embed.set_image(url=game['header_image'])
+    embed.add_field(name="Release Date", value=game['release_date']['date'], inline=True)
+    embed.add_field(name="Developer", value=", ".join(game.get('developers', [])), inline=True)
+    embed.add_field(name="Publisher", value=", ".join(game.get('publishers', [])), inline=True)
+    if game.get('is_free'):
+        embed.add_field(name="Price", value="Free to Play", inline=True)
+    elif 'price_overview' in game:
+        price = game['price_overview']
+        embed.add_field(name="Price", value=f"{price['final_formatted']}", inline=True)
+    return embed
+
+
+async def respond_progressively(interaction, cached, fetch, render, not_found, what):
+    """Fill in a deferred response, showing cached data first when there is any.
+
+    `cached` is a (value, is_fresh) pair from a SteamClient peek, or None. A
+    fresh value is shown as-is. A stale one is shown straight away and then
+    edited in place once `fetch()` returns.
+    """
+    shown = False
+    if cached is not None:
+        value, fresh = cached
+        if fresh:
+            if value:
+                await interaction.edit_original_response(embed=render(value))
+            else:
+                await interaction.edit_original_response(content=not_found)
+            return
+        if value:
+            embed = render(value)
+            embed.set_footer(text="Cached data, refreshing from Steam…")
+            await interaction.edit_original_response(embed=embed)
+            shown = True
+
+    try:
+        value = await fetch()
+    except Exception as e:
+        if not shown:
+            raise
+        embed = render(cached[0])
+        embed.set_footer(text="Cached data, Steam couldn't be reached")
+        await interaction.edit_original_response(content=steam_error_message(e, what), embed=embed)
+        return
+    if not value:
+        await interaction.edit_original_response(content=not_found, embed=None)
+        return
+    await interaction.edit_original_response(content=None, embed=render(value))
+
+
 @bot.tree.command(name="steam_user", description="Get Steam user information")
-async def steam_user(interaction: discord.Interaction, steam_id: str):
+@app_commands.describe(steam_id="SteamID64 or vanity URL (defaults to your linked account)")
+async def steam_user(interaction: discord.Interaction, steam_id: str = None):
+    # Acknowledge right away so slow Steam responses can't blow the 3s interaction window
+    await interaction.response.defer()
     try:
-        steam_id = await resolve_steam_id(steam_id)
+        steam_id = await command_steam_id(interaction, steam_id)
         if not steam_id:
-            await interaction.response.send_message("Invalid Steam ID or vanity URL.")
             return
-        url = f"{STEAM_API_BASE}/ISteamUser/GetPlayerSummaries/v0002/"
-        params = {'key': steam_api_key, 'steamids': steam_id}
-        resp = requests.get(url, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        players = data.get('response', {}).get('players', [])
-        if not players:
-            await interaction.response.send_message("User not found or profile is private.")
-            return
-        user = players[0]
-        embed = discord.Embed(
-            title=f"Steam Profile: {user.get('personaname', 'Unknown')}",
-            color=0x1b2838
-        )
-        embed.add_field(name="Steam ID", value=user.get('steamid', 'Unknown'), inline=True)
-        embed.add_field(
-            name="Profile State",
-            value="Public" if user.get('communityvisibilitystate', 1) == 3 else "Private",
-            inline=True
+        prefetcher.record('player', steam_id)
+        cached, snapshot_age = await local_copy(steam.peek_player_summary(steam_id), steam_id, 'summary')
+        await respond_progressively(
+            interaction,
+            cached,
+            lambda: steam.get_player_summary(steam_id),
+            snapshot_render(user_embed, snapshot_age),
+            "User not found or profile is private.",
+            "Steam user data",
         )
-        embed.add_field(name="Profile Created", value=user.get('timecreated', 'Unknown'), inline=True)
-        embed.add_field(name="Profile URL", value=user.get('profileurl', 'Unknown'), inline=False)
-        if 'avatarfull' in user:
-            embed.set_thumbnail(url=user['avatarfull'])
-        await interaction.response.send_message(embed=embed)
     except Exception as e:
-        await interaction.response.send_message(f"Error fetching Steam user data: {str(e)}")
+        await interaction.edit_original_response(content=steam_error_message(e, "Steam user data"))
 
 @bot.tree.command(name="steam_games", description="Get user's recently played games")
-async def steam_games(interaction: discord.Interaction, steam_id: str):
+@app_commands.describe(steam_id="SteamID64 or vanity URL (defaults to your linked account)")
+async def steam_games(interaction: discord.Interaction, steam_id: str = None):
+    await interaction.response.defer()
     try:
-        steam_id = await resolve_steam_id(steam_id)
+        steam_id = await command_steam_id(interaction, steam_id)
         if not steam_id:
-            await interaction.response.send_message("Invalid Steam ID or vanity URL.")
             return
-        url = f"{STEAM_API_BASE}/IPlayerService/GetRecentlyPlayedGames/v0001/"
-        params = {'key': steam_api_key, 'steamid': steam_id, 'count': 5}
-        resp = requests.get(url, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        games = data.get('response', {}).get('games', [])
-        if not games:
-            await interaction.response.send_message("No recently played games found or profile is private.")
+        prefetcher.record('games', steam_id)
+        cached, snapshot_age = await local_copy(steam.peek_recently_played_games(steam_id, count=5), steam_id, 'games')
+        await respond_progressively(
+            interaction,
+            cached,
+            lambda: steam.get_recently_played_games(steam_id, count=5),
+            snapshot_render(games_embed, snapshot_age),
+            "No recently played games found or profile is private.",
+            "Steam games data",
+        )
+    except Exception as e:
+        await interaction.edit_original_response(content=steam_error_message(e, "Steam games data"))
+
+@bot.tree.command(name="steam_link", description="Link your Steam account so Steam commands default to it")
+@app_commands.describe(steam_id="Your SteamID64 or vanity URL")
+async def steam_link(interaction: discord.Interaction, steam_id: str):
+    await interaction.response.defer(ephemeral=True)
+    if not accounts.available:
+        await interaction.edit_original_response(content="Account linking is unavailable right now.")
+        return
+    try:
+        resolved = await resolve_steam_id(steam_id)
+        if not resolved:
+            await interaction.edit_original_response(content="Invalid Steam ID or vanity URL.")
+            return
+        player = await steam.get_player_summary(resolved)
+        if not player:
+            await interaction.edit_original_response(content="No Steam profile found for that ID.")
             return
-        embed = discord.Embed(title="Recently Played Games", color=0x1b2838)
-        for game in games[:5]:
-            total_hours = round(game['playtime_forever'] / 60, 1)
-            recent_hours = round(game.get('playtime_2weeks', 0)/60, 1)
-            embed.add_field(
-                name=game['name'],
-                value=f"Total: {total_hours}h\nRecent: {recent_hours}h",
-                inline=True
-            )
-        await interaction.response.send_message(embed=embed)
+        await accounts.link(interaction.user.id, resolved)
+        await interaction.edit_original_response(
+            content=f"✅ Linked to **{player.get('personaname', resolved)}** ({resolved}).")
     except Exception as e:
-        await interaction.response.send_message(f"Error fetching Steam games data: {str(e)}")
+        await interaction.edit_original_response(content=steam_error_message(e, "the Steam profile"))
+
+
+@bot.tree.command(name="steam_unlink", description="Unlink your Steam account")
+async def steam_unlink(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    if not accounts.available:
+        await interaction.edit_original_response(content="Account linking is unavailable right now.")
+        return
+    try:
+        removed = await accounts.unlink(interaction.user.id)
+    except Exception as e:
+        logging.error(f"Error unlinking Steam account of {interaction.user.id}: {e}")
+        await interaction.edit_original_response(content="Couldn't unlink your account, please try again later.")
+        return
+    await interaction.edit_original_response(
+        content="✅ Steam account unlinked." if removed else "No Steam account was linked.")
+
 
 @bot.tree.command(name="steam_game_info", description="Get information about a specific game")
 async def steam_game_info(interaction: discord.Interaction, app_id: str):
+    await interaction.response.defer()
     try:
-        url = "https://store.steampowered.com/api/appdetails"
-        params = {'appids': app_id, 'format': 'json'}
-        resp = requests.get(url, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        if not data or app_id not in data or not data[app_id]['success']:
-            await interaction.response.send_message("Game not found or invalid App ID.")
-            return
-        game = data[app_id]['data']
-        embed = discord.Embed(
-            title=game['name'],
-            description=game.get('short_description', 'No description available')[:500],
-            color=0x1b2838
+        if app_id.isdigit():
+            prefetcher.record('app', app_id)
+        await respond_progressively(
+            interaction,
+            steam.peek_app_details(app_id),
+            lambda: steam.get_app_details(app_id),
+            game_embed,
+            "Game not found or invalid App ID.",
+            "game information",
         )
-        if 'header_image' in game:
-            embed.set_image(url=game['header_image'])
-        embed.add_field(name="Release Date", value=game['release_date']['date'], inline=True)
-        embed.add_field(name="Developer", value=", ".join(game.get('developers', [])), inline=True)
-        embed.add_field(name="Publisher", value=", ".join(game.get('publishers', [])), inline=True)
-        if game.get('is_free'):
-            embed.add_field(name="Price", value="Free to Play", inline=True)
-        elif 'price_overview' in game:
-            price = game['price_overview']
-            embed.add_field(name="Price", value=f"{price['final_formatted']}", inline=True)
-        await interaction.response.send_message(embed=embed)
     except Exception as e:
-        await interaction.response.send_message(f"Error fetching game information: {str(e)}")
+        await interaction.edit_original_response(content=steam_error_message(e, "game information"))
+
+
+@bot.tree.command(name="metrics", description="Show Steam and command latency (Admin only)")
+@app_commands.default_permissions(administrator=True)
+async def show_metrics(interaction: discord.Interaction, kind: str = 'steam'):
+    rows = metrics.top(kind)
+    embed = discord.Embed(title=f"⏱️ Latency: {kind}", color=0x1b2838)
+    if not rows:
+        embed.description = "Nothing recorded yet. Kinds: command, event, steam, steam_queue, loop"
+    else:
+        embed.description = "\n".join(
+            f"`{name}` {summary['count']}x, p50 {format_seconds(summary['p50'])}, "
+            f"p99 {format_seconds(summary['p99'])}, max {format_seconds(summary['max'])}"
+            for name, summary in rows
+        )
+    prefetch = prefetcher.stats()
+    limiter = steam.limiter.stats()
+    embed.set_footer(text=f"Event loop lag: {format_seconds(loop_lag.last_lag)} · "
+                          f"Steam queue: {limiter['queue_depth']} waiting, "
+                          f"avg wait {format_seconds(limiter['avg_wait'])}, "
+                          f"max {format_seconds(limiter['max_wait'])} · "
+                          f"popular lookups served from cache: {prefetch['local_rate']:.0%} "
+                          f"({prefetch['warm']} warm, {prefetch['requests']} prefetch requests)")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 
 # ---------- FUN COMMAND ----------
 
@@ -200,4 +453,5 @@ async def balls(interaction: discord.Interaction, user: discord.Member):
     await interaction.response.send_message(f"Okay! taking {name}'s balls")
 
 # ---------- RUN BOT ----------
-bot.run(token, log_handler=handler, log_level=logging.DEBUG)
+if __name__ == "__main__":
+    bot.run(token, log_handler=handler, log_level=log_level)
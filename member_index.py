@@ -0,0 +1,277 @@
+import asyncio
+import logging
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+# MEMBER_CACHE policies: 'full' keeps discord.py's default (every member
+# cached, all guilds chunked before on_ready); 'lean' caches no members and
+# fills the index by chunking guilds with cache=False.
+POLICIES = ('lean', 'full')
+# MEMBER_CHUNKING for the lean policy: 'lazy' indexes every guild in the
+# background after on_ready; 'on_demand' only indexes a guild the first time
+# something in it needs its members.
+CHUNKING = ('lazy', 'on_demand')
+
+
+def cache_options(policy, intents):
+    """Client keyword arguments for a MEMBER_CACHE policy"""
+    if policy not in POLICIES:
+        raise ValueError(f"MEMBER_CACHE must be one of {', '.join(POLICIES)}, not {policy!r}")
+    if policy == 'full':
+        return {'member_cache_flags': discord.MemberCacheFlags.from_intents(intents),
+                'chunk_guilds_at_startup': True}
+    return {'member_cache_flags': discord.MemberCacheFlags.none(), 'chunk_guilds_at_startup': False}
+
+
+def payload_names(user, nick=None):
+    """(username, display_name) from a gateway user object, as str(member) / member.display_name"""
+    name = user['username']
+    username = name if user.get('discriminator', '0') in ('0', '0000') else f"{name}#{user['discriminator']}"
+    return username, nick or user.get('global_name') or name
+
+
+class MemberIndex:
+    """The member fields the database side persists, without discord.Member objects.
+
+    usernames maps user_id -> username once per user; guilds maps guild_id ->
+    {user_id: display_name}, since nicknames are per guild. Bot accounts are
+    never indexed. Member sync and name updates read from here, so the
+    library's member cache can be switched off.
+    """
+
+    def __init__(self):
+        self.usernames = {}
+        self.guilds = {}
+
+    def __len__(self):
+        return sum(len(members) for members in self.guilds.values())
+
+    def has_guild(self, guild_id):
+        return guild_id in self.guilds
+
+    def get(self, guild_id, user_id):
+        """(username, display_name) of a member, or None if not indexed"""
+        display_name = self.guilds.get(guild_id, {}).get(user_id)
+        if display_name is None:
+            return None
+        return self.usernames[user_id], display_name
+
+    def set(self, guild_id, user_id, username, display_name):
+        """Index a member; returns the previous (username, display_name) or None"""
+        before = self.get(guild_id, user_id)
+        self.usernames[user_id] = username
+        self.guilds.setdefault(guild_id, {})[user_id] = display_name
+        return before
+
+    def add_member(self, member):
+        """Index a member who joined; guilds not indexed yet are left to their chunk request"""
+        if not member.bot and member.guild.id in self.guilds:
+            self.set(member.guild.id, member.id, str(member), member.display_name)
+
+    def replace_guild(self, guild_id, members):
+        """Index a guild from scratch, e.g. from the result of a chunk request"""
+        display_names = {}
+        for member in members:
+            if member.bot:
+                continue
+            self.usernames[member.id] = str(member)
+            display_names[member.id] = member.display_name
+        self.guilds[guild_id] = display_names
+
+    def update_payload(self, guild_id, data):
+        """Apply a raw GUILD_MEMBER_UPDATE payload.
+
+        Returns (user_id, before, after) when the member's names changed,
+        before being None for a member the index didn't know yet. Guilds not
+        indexed yet are skipped; their chunk request will pick the change up.
+        """
+        user = data['user']
+        if user.get('bot') or guild_id not in self.guilds:
+            return None
+        return self._update(guild_id, int(user['id']), payload_names(user, data.get('nick')))
+
+    def update_member(self, member):
+        """update_payload() for a discord.Member, as on_member_update passes it"""
+        if member.bot or member.guild.id not in self.guilds:
+            return None
+        return self._update(member.guild.id, member.id, (str(member), member.display_name))
+
+    def _update(self, guild_id, user_id, after):
+        before = self.set(guild_id, user_id, *after)
+        if before == after:
+            return None
+        return user_id, before, after
+
+    def remove(self, guild_id, user_id):
+        """Remove a member; True if the user is no longer in any indexed guild"""
+        members = self.guilds.get(guild_id)
+        if members is None or members.pop(user_id, None) is None:
+            return False
+        if any(user_id in members for members in self.guilds.values()):
+            return False
+        self.usernames.pop(user_id, None)
+        return True
+
+    def drop_guild(self, guild_id):
+        """Remove a guild; returns the users no longer in any indexed guild"""
+        members = self.guilds.pop(guild_id, None)
+        if not members:
+            return set()
+        shared = set()
+        for other in self.guilds.values():
+            shared.update(members.keys() & other.keys())
+        gone = members.keys() - shared
+        for user_id in gone:
+            self.usernames.pop(user_id, None)
+        return gone
+
+    def candidates(self, guild_ids):
+        """{user_id: [(username, display_name) per indexed guild]} for members of the given guilds.
+
+        Every guild a member shares with the bot is included, not just the
+        given ones, so syncing one guild doesn't flip a stored display name
+        that matches another.
+        """
+        users = set()
+        for guild_id in guild_ids:
+            users.update(self.guilds.get(guild_id, ()))
+        candidates = {}
+        for members in self.guilds.values():
+            small, large = (users, members) if len(users) < len(members) else (members, users)
+            for user_id in small:
+                if user_id in large:
+                    candidates.setdefault(user_id, []).append((self.usernames[user_id], members[user_id]))
+        return candidates
+
+
+def install_gateway_hook(bot, index):
+    """Keep the index current from raw GUILD_MEMBER_UPDATE payloads.
+
+    discord.py only dispatches member_update/user_update for members it has
+    cached, so with the member cache off the raw payload is the only place a
+    rename shows up. Discord sends GUILD_MEMBER_UPDATE for username and global
+    name changes too, once per shared guild (discord.py derives user_update
+    from it), so no on_user_update handler is needed. Changes are
+    re-dispatched as on_member_names_update(guild_id, user_id, before, after)
+    with (username, display_name) tuples; the library's own handling still
+    runs.
+
+    The parser table is private. If a discord.py release drops it, this falls
+    back to on_member_update, which only covers cached members. Returns
+    whether the raw hook is installed.
+    """
+    parsers = getattr(bot._connection, 'parsers', None)
+    parse = parsers.get('GUILD_MEMBER_UPDATE') if isinstance(parsers, dict) else None
+    if parse is None:
+        logger.warning("No GUILD_MEMBER_UPDATE parser to hook; member renames come from on_member_update, "
+                       "so with MEMBER_CACHE=lean they only show up when a guild is re-indexed")
+
+        async def on_member_update(before, after):
+            change = index.update_member(after)
+            if change is not None:
+                bot.dispatch('member_names_update', after.guild.id, *change)
+
+        bot.add_listener(on_member_update)
+        return False
+
+    def parse_member_update(data):
+        guild_id = int(data['guild_id'])
+        change = index.update_payload(guild_id, data)
+        if change is not None:
+            bot.dispatch('member_names_update', guild_id, *change)
+        parse(data)
+
+    parsers['GUILD_MEMBER_UPDATE'] = parse_member_update
+    return True
+
+
+class GuildIndexer:
+    """Fills a MemberIndex one guild at a time.
+
+    With the full policy a guild is indexed from guild.members; with the lean
+    policy it is chunked with cache=False, so the Member objects only live
+    until they are indexed. Chunk requests go through the gateway's rate
+    limit, hence one guild at a time per shard by default.
+    """
+
+    def __init__(self, index, policy='lean', chunking='lazy', on_indexed=None):
+        if chunking not in CHUNKING:
+            raise ValueError(f"MEMBER_CHUNKING must be one of {', '.join(CHUNKING)}, not {chunking!r}")
+        self.index = index
+        self.policy = policy
+        self.chunking = chunking
+        self.on_indexed = on_indexed  # async callback(guild) after a guild is (re)indexed
+        self._pending = {}  # guild_id -> task indexing it
+        self._task = None
+
+    async def _fetch(self, guild):
+        if self.policy == 'full':
+            return guild.members
+        return await guild.chunk(cache=False)
+
+    async def _index(self, guild):
+        try:
+            members = await self._fetch(guild)
+        except (discord.ClientException, asyncio.TimeoutError) as e:
+            logger.error(f"Could not index members of {guild.name} ({guild.id}): {e}")
+            return
+        if members is None:  # guild went away meanwhile
+            return
+        self.index.replace_guild(guild.id, members)
+        del members
+        logger.debug(f"Indexed members of {guild.name} ({guild.id})")
+        if self.on_indexed is not None:
+            # A failing callback mustn't stop the remaining guilds from being indexed
+            try:
+                await self.on_indexed(guild)
+            except Exception as e:
+                logger.error(f"Handling indexed members of {guild.name} ({guild.id}) failed: {e}")
+
+    @property
+    def eager(self):
+        """Whether every guild is indexed up front (anything but lean + on_demand)"""
+        return self.policy == 'full' or self.chunking == 'lazy'
+
+    def _schedule(self, guild):
+        task = self._pending.get(guild.id)
+        if task is None:
+            task = self._pending[guild.id] = asyncio.create_task(self._index(guild))
+            task.add_done_callback(lambda _: self._pending.pop(guild.id, None))
+        return task
+
+    async def ensure(self, guild):
+        """Index a guild unless it already is; concurrent callers share one chunk request"""
+        if not self.index.has_guild(guild.id):
+            await asyncio.shield(self._schedule(guild))
+
+    def touch(self, guild):
+        """With on_demand chunking, start indexing a guild in the background the first time it's used"""
+        if not self.eager and guild is not None and not self.index.has_guild(guild.id):
+            self._schedule(guild)
+
+    def start(self, guilds):
+        """(Re)index guilds in the background; called on every new gateway session.
+
+        A new session may have missed updates, so guilds already in the index
+        are refreshed too. With on_demand chunking only those are.
+        """
+        if self._task is not None:
+            self._task.cancel()
+        if not self.eager:
+            guilds = [guild for guild in guilds if self.index.has_guild(guild.id)]
+        self._task = asyncio.create_task(self._index_all(list(guilds)))
+
+    async def _index_all(self, guilds):
+        started = asyncio.get_running_loop().time()
+        for guild in guilds:
+            await self._index(guild)
+        elapsed = asyncio.get_running_loop().time() - started
+        logger.info(f"Indexed {len(self.index)} memberships in {len(guilds)} guilds in {elapsed:.1f}s")
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        for task in self._pending.values():
+            task.cancel()
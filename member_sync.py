@@ -0,0 +1,100 @@
+import logging
+
+from db_statements import STATEMENTS
+
+logger = logging.getLogger(__name__)
+
+
+class MemberSync:
+    """Incremental guild/member sync: only rows that differ from the database are written.
+
+    What's stored is mirrored in memory, so reconnects that fire on_ready
+    again cost no database work unless members actually changed. Only this
+    process's share is mirrored: guilds on its shards, and users looked up the
+    first time one of its guilds' members is synced. Members are read from a
+    MemberIndex, not guild.members.
+    """
+
+    def __init__(self, db, index, chunk_size=1000, stats=None, shard_ids=None, shard_count=None):
+        self.db = db
+        self.index = index
+        self.stats = stats
+        self.chunk_size = chunk_size
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.known_users = {}  # user_id -> (username, display_name), None if not stored
+        self.known_guilds = set()
+        self.loaded = False
+
+    async def load(self):
+        """Read which of this process's guilds are stored; done once, before the first sync"""
+        if self.shard_ids is None:
+            guilds = await self.db.query(STATEMENTS['load_known_guilds'])
+        else:
+            query = STATEMENTS['load_known_guilds_for_shards'].format(
+                shards=", ".join(["%s"] * len(self.shard_ids)))
+            guilds = await self.db.query(query, (self.shard_count, *self.shard_ids))
+        self.known_guilds.update(row['guild_id'] for row in guilds or [])
+        self.loaded = True
+        logger.info(f"Loaded {len(self.known_guilds)} known guilds")
+
+    async def load_users(self, user_ids):
+        """Mirror the stored rows of users not looked up yet"""
+        missing = [user_id for user_id in user_ids if user_id not in self.known_users]
+        for i in range(0, len(missing), self.chunk_size):
+            chunk = missing[i:i + self.chunk_size]
+            query = STATEMENTS['load_known_users'].format(users=", ".join(["%s"] * len(chunk)))
+            rows = await self.db.query(query, tuple(chunk))
+            if rows is None:
+                continue  # left unknown, so they are simply written again
+            stored = {row['user_id']: (row['username'], row['display_name']) for row in rows}
+            for user_id in chunk:
+                self.known_users[user_id] = stored.get(user_id)
+
+    def remember(self, user_id, username, display_name=None):
+        """Record a write made outside sync() so the next sync doesn't repeat it"""
+        if display_name is None:
+            display_name = (self.known_users.get(user_id) or (None, None))[1]
+        self.known_users[user_id] = (username, display_name)
+
+    def forget(self, user_id):
+        self.known_users.pop(user_id, None)
+
+    def diff(self, candidates):
+        """Return (members checked, rows that need writing) for index.candidates() output"""
+        # users is global but display names are per guild: a stored row that
+        # matches the member in any guild counts as up to date
+        changed = []
+        for user_id, rows in candidates.items():
+            if self.known_users.get(user_id) not in rows:
+                changed.append((user_id, *rows[0]))
+        return len(candidates), changed
+
+    async def sync(self, guilds):
+        """Write new or changed guilds and members; returns (members checked, rows written)"""
+        if not self.loaded:
+            await self.load()
+
+        new_guilds = [(guild.id, guild.name) for guild in guilds if guild.id not in self.known_guilds]
+        if new_guilds:
+            inserted = await self.db.update_many(STATEMENTS['insert_guild'], new_guilds)
+            if inserted is not None:
+                if self.stats is not None:
+                    self.stats.guilds_added(inserted)
+                self.known_guilds.update(guild_id for guild_id, _ in new_guilds)
+
+        candidates = self.index.candidates(guild.id for guild in guilds)
+        await self.load_users(candidates)
+        checked, changed = self.diff(candidates)
+        written = 0
+        for i in range(0, len(changed), self.chunk_size):
+            chunk = changed[i:i + self.chunk_size]
+            # A row count of 0 only means the rows were already up to date
+            if await self.db.update_many(STATEMENTS['upsert_member'], chunk) is not None:
+                if self.stats is not None:
+                    self.stats.users_added(sum(1 for row in chunk if self.known_users.get(row[0]) is None))
+                for user_id, username, display_name in chunk:
+                    self.known_users[user_id] = (username, display_name)
+                written += len(chunk)
+            logger.info(f"Member sync: wrote {min(i + self.chunk_size, len(changed))}/{len(changed)} changed rows")
+        return checked, written
@@ -0,0 +1,192 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds in seconds, roughly 1-2.5-5 steps from 0.1ms to 30s
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'),
+)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; observe() is a bisect and a few adds"""
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile (capped at the observed max)"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class Metrics:
+    """Latency histograms keyed by (kind, name), e.g. ('command', 'profile').
+
+    Kinds in use: command, event, db, db_queue, steam, loop. Database timings
+    are recorded from executor threads, hence the lock.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.gauges = {}  # prefix -> callable returning {name: number}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def observe(self, kind, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get((kind, name))
+            if histogram is None:
+                histogram = self.histograms[(kind, name)] = Histogram()
+            histogram.observe(seconds)
+
+    def timed(self, kind, name=None):
+        """Decorator recording how long an async function takes, errors included"""
+        def decorator(func):
+            label = name or func.__name__
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.observe(kind, label, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def summaries(self, kind=None):
+        """{(kind, name): summary}, optionally for one kind only"""
+        with self._lock:
+            items = list(self.histograms.items())
+        return {key: histogram.summary() for key, histogram in items if kind is None or key[0] == kind}
+
+    def top(self, kind, limit=10, by='p99'):
+        """The `limit` names of a kind with the highest `by` value"""
+        rows = [(key[1], summary) for key, summary in self.summaries(kind).items()]
+        rows.sort(key=lambda row: row[1][by], reverse=True)
+        return rows[:limit]
+
+    def register_gauges(self, prefix, source):
+        """Export the numbers `source()` returns as bot_<prefix>_<name> gauges"""
+        self.gauges[prefix] = source
+
+    def render_prometheus(self):
+        """Prometheus text exposition of every histogram and registered gauge"""
+        lines = ["# TYPE bot_latency_seconds histogram"]
+        with self._lock:
+            items = [(key, list(h.counts), h.count, h.total) for key, h in self.histograms.items()]
+        for (kind, name), counts, count, total in sorted(items):
+            labels = f'kind="{kind}",name="{_escape(name)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'bot_latency_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'bot_latency_seconds_sum{{{labels}}} {total}')
+            lines.append(f'bot_latency_seconds_count{{{labels}}} {count}')
+        for prefix, source in sorted(self.gauges.items()):
+            for name, value in sorted(source().items()):
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE bot_{prefix}_{name} gauge")
+                    lines.append(f"bot_{prefix}_{name} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+class LoopLagMonitor:
+    """Samples event-loop lag: how late a sleep(interval) wakes up"""
+
+    def __init__(self, metrics, interval=0.5):
+        self.metrics = metrics
+        self.interval = interval
+        self.last_lag = 0.0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._sample())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _sample(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.metrics.observe('loop', 'lag', self.last_lag)
+
+
+class MetricsServer:
+    """Serves GET /metrics on a local port (127.0.0.1 unless told otherwise)"""
+
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        self.metrics = metrics
+        self.port = port
+        self.host = host
+        self._runner = None
+
+    async def start(self):
+        async def handle(request):
+            return web.Response(text=self.metrics.render_prometheus(), content_type='text/plain')
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+def format_seconds(seconds):
+    if seconds >= 1:
+        return f"{seconds:.2f}s"
+    return f"{seconds * 1000:.1f}ms"
+
+
+# Process-wide registry shared by the bot, the database layer and the Steam client
+metrics = Metrics()
@@ -0,0 +1,78 @@
+import datetime
+import logging
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileCache:
+    """Read-through cache of users rows, kept current by every write path.
+
+    Rows loaded from MySQL have points still sitting in the write-behind
+    buffer added on top, so a profile read right after !addpoints is correct
+    before the buffer flushes.
+    """
+
+    def __init__(self, db, write_buffer, maxsize=10000, max_bytes=8 * 1024 * 1024, ttl=600, stats=None,
+                 read_attempts=3):
+        self.db = db
+        self.write_buffer = write_buffer
+        self.stats = stats
+        self.read_attempts = read_attempts
+        self.cache = TTLCache(maxsize=maxsize, max_bytes=max_bytes, default_ttl=ttl)
+
+    async def get(self, member):
+        """Return the users row for a member, creating it if it doesn't exist yet"""
+        row = self.cache.get(member.id)
+        if row is not None:
+            return row
+
+        # A batch committing while the SELECT runs could be counted twice (in
+        # the row and in unflushed_points), so such reads are retried
+        for _ in range(self.read_attempts):
+            version = self.write_buffer.flush_version
+            row = await self._load(member)
+            if version % 2 == 0 and version == self.write_buffer.flush_version:
+                row['points'] += self.write_buffer.unflushed_points(member.id)
+                self.cache.set(member.id, row)
+                return row
+        # Still racing flushes: the committed row alone is never too high, don't cache it
+        return row
+
+    async def _load(self, member):
+        result = await self.db.prepared_query('select_user', (member.id,))
+        if result:
+            row = dict(result[0])
+        elif result is not None:
+            inserted = await self.db.prepared_update('upsert_member', (member.id, str(member), member.display_name))
+            if inserted == 1 and self.stats is not None:
+                self.stats.users_added()
+            # Fresh row: the table defaults, no second SELECT needed
+            row = {
+                'user_id': member.id,
+                'username': str(member),
+                'display_name': member.display_name,
+                'points': 0,
+                'level': 1,
+                'experience': 0,
+                'created_at': datetime.datetime.now(),
+            }
+        else:
+            raise RuntimeError(f"Couldn't load user {member.id} from the database")
+        return row
+
+    def update_names(self, user_id, username, display_name=None):
+        row = self.cache.peek(user_id)
+        if row is not None:
+            row[0]['username'] = username
+            if display_name is not None:
+                row[0]['display_name'] = display_name
+
+    def add_points(self, user_id, amount):
+        row = self.cache.peek(user_id)
+        if row is not None:
+            row[0]['points'] += amount
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,121 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request can't get a token in time or the wait queue is full"""
+
+
+class RateLimiter:
+    """Token bucket shared by many callers, with a bounded priority wait queue.
+
+    Lower priority numbers are served first. Callers that couldn't be served
+    within their timeout are rejected up front instead of queueing.
+    """
+
+    def __init__(self, rate, burst, max_queue=200, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.paused_until = 0.0
+        self._queue = []  # (priority, seq, future)
+        self._seq = itertools.count()
+        self._dispatcher = None
+        # metrics
+        self.acquired = 0
+        self.rejected = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queue_depth(self):
+        return sum(1 for _, _, future in self._queue if not future.done())
+
+    def _refill(self):
+        now = self.clock()
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        return now
+
+    def _estimated_wait(self, priority):
+        """Seconds until a new caller with this priority would get a token"""
+        now = self._refill()
+        ahead = sum(1 for p, _, future in self._queue if p <= priority and not future.done())
+        wait = max(0.0, (ahead + 1 - self.tokens) / self.rate)
+        return wait + max(0.0, self.paused_until - now)
+
+    def idle(self, reserve=0):
+        """True when nobody is waiting and more than `reserve` tokens are available"""
+        now = self._refill()
+        return self.queue_depth == 0 and self.tokens >= reserve + 1 and now >= self.paused_until
+
+    def pause(self, seconds):
+        """Stop handing out tokens for a while, e.g. after a 429"""
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+    async def acquire(self, priority=PRIORITY_INTERACTIVE, timeout=None):
+        now = self._refill()
+        if not self._queue and self.tokens >= 1 and now >= self.paused_until:
+            self.tokens -= 1
+            self.acquired += 1
+            return
+
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise RateLimitExceeded("Request queue is full")
+        if timeout is not None and self._estimated_wait(priority) > timeout:
+            self.rejected += 1
+            raise RateLimitExceeded("Request can't be served in time")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+        started = self.clock()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise RateLimitExceeded("Timed out waiting for a request slot") from None
+        waited = self.clock() - started
+        self.acquired += 1
+        self.waited += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    async def _dispatch(self):
+        while self._queue:
+            now = self._refill()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            while self._queue and self.tokens >= 1:
+                _, _, future = heapq.heappop(self._queue)
+                if future.done():  # caller gave up
+                    continue
+                self.tokens -= 1
+                future.set_result(None)
+            if self._queue:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def stats(self):
+        return {
+            'tokens': round(self.tokens, 2),
+            'queue_depth': self.queue_depth,
+            'acquired': self.acquired,
+            'rejected': self.rejected,
+            'avg_wait': self.total_wait / self.waited if self.waited else 0.0,
+            'max_wait': self.max_wait,
+        }
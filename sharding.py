@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+
+from db_statements import STATEMENTS
+
+logger = logging.getLogger(__name__)
+
+SHARD_STATUS_TABLE = """
+    CREATE TABLE IF NOT EXISTS shard_status (
+        shard_id INT PRIMARY KEY,
+        shard_count INT NOT NULL,
+        cluster VARCHAR(64) NOT NULL,
+        host VARCHAR(255) NOT NULL,
+        pid INT NOT NULL,
+        guilds INT NOT NULL,
+        members INT NOT NULL,
+        latency_ms INT NULL,
+        loop_lag_ms INT NULL,
+        db_in_use INT NOT NULL DEFAULT 0,
+        started_at TIMESTAMP NOT NULL,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+"""
+
+
+def parse_shard_ids(value):
+    """'0-3,8' -> [0, 1, 2, 3, 8]"""
+    shard_ids = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            shard_ids.extend(range(int(first), int(last) + 1))
+        else:
+            shard_ids.append(int(part))
+    return sorted(set(shard_ids))
+
+
+def shard_config():
+    """(shard_count, shard_ids, cluster) from SHARD_COUNT / SHARD_IDS / CLUSTER_ID.
+
+    Unset means one process running every shard, with the count Discord recommends.
+    """
+    shard_count = int(os.environ['SHARD_COUNT']) if os.getenv('SHARD_COUNT') else None
+    shard_ids = parse_shard_ids(os.environ['SHARD_IDS']) if os.getenv('SHARD_IDS') else None
+    if shard_ids is not None and shard_count is None:
+        raise ValueError("SHARD_IDS needs SHARD_COUNT")
+    cluster = os.getenv('CLUSTER_ID') or (f"shards-{os.environ['SHARD_IDS']}" if shard_ids else 'main')
+    return shard_count, shard_ids, cluster
+
+
+class ShardStatus:
+    """Publishes this process's shards to shard_status and reads the whole cluster back.
+
+    Every process heartbeats its own rows; rows not updated for three
+    intervals belong to a process that is down. The process running shard 0
+    is the coordinator and the only one doing cluster-wide maintenance,
+    including pruning rows of shards gone for `prune_after` seconds or beyond
+    the current shard count.
+    """
+
+    def __init__(self, db, bot, cluster, interval=30, loop_lag=None, prune_after=24 * 60 * 60):
+        self.db = db
+        self.bot = bot
+        self.cluster = cluster
+        self.interval = interval
+        self.loop_lag = loop_lag
+        self.prune_after = prune_after
+        self.started_at = None  # the database's NOW() when start() ran
+        self._task = None
+
+    @property
+    def shard_ids(self):
+        return self.bot.shard_ids if self.bot.shard_ids is not None else list(range(self.bot.shard_count or 1))
+
+    @property
+    def is_coordinator(self):
+        return self.bot.shard_ids is None or 0 in self.bot.shard_ids
+
+    async def start(self):
+        await self.db.update(SHARD_STATUS_TABLE)
+        # Taken from the server so it compares with updated_at whatever the host's time zone
+        rows = await self.db.query(STATEMENTS['database_now'])
+        self.started_at = rows[0]['now'] if rows else time.strftime('%Y-%m-%d %H:%M:%S')
+        self._task = asyncio.create_task(self._report_periodically())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _report_periodically(self):
+        await self.bot.wait_until_ready()
+        while True:
+            try:
+                await self.report()
+            except Exception as e:
+                logger.error(f"Shard status report failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def local_rows(self):
+        guilds = {shard_id: 0 for shard_id in self.shard_ids}
+        members = dict(guilds)
+        for guild in self.bot.guilds:
+            guilds[guild.shard_id] = guilds.get(guild.shard_id, 0) + 1
+            members[guild.shard_id] = members.get(guild.shard_id, 0) + (guild.member_count or 0)
+        loop_lag = round(1000 * self.loop_lag.last_lag) if self.loop_lag is not None else None
+        in_use = self.db.pool_stats()['in_use']
+        rows = []
+        for shard_id in guilds:
+            shard = self.bot.get_shard(shard_id)
+            latency = shard.latency if shard is not None else None
+            rows.append((
+                shard_id, self.bot.shard_count or 1, self.cluster, socket.gethostname(), os.getpid(),
+                guilds[shard_id], members[shard_id],
+                round(1000 * latency) if latency is not None and latency != float('inf') else None,
+                loop_lag, in_use, self.started_at,
+            ))
+        return rows
+
+    async def report(self):
+        await self.db.update_many(STATEMENTS['upsert_shard_status'], self.local_rows())
+        if self.is_coordinator:
+            await self.prune()
+
+    async def prune(self):
+        """Delete rows of shards that are gone: stale for prune_after, or left over from a larger shard count"""
+        pruned = await self.db.update(STATEMENTS['prune_shard_status'], (self.bot.shard_count or 1, self.prune_after))
+        if pruned:
+            logger.info(f"Pruned {pruned} stale shard_status rows")
+
+    async def cluster_status(self):
+        """Rows for every shard in the cluster, each with a `stale` flag"""
+        rows = await self.db.query(STATEMENTS['load_shard_status']) or []
+        for row in rows:
+            row['stale'] = row['age'] is None or row['age'] > 3 * self.interval
+        return rows
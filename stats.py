@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+
+from db_statements import STATEMENTS
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseStats:
+    """Running counters behind !dbstats.
+
+    Write paths bump the counters as they go; a periodic reconciliation
+    recomputes them in one query to correct any drift. In a sharded
+    deployment only the coordinator reconciles on a schedule; other
+    processes start a background reconciliation when !dbstats finds their
+    counters older than interval, at most one per interval.
+    """
+
+    def __init__(self, db, interval=300):
+        self.db = db
+        self.interval = interval
+        self.users = 0
+        self.guilds = 0
+        self.total_points = 0
+        self.active_users = 0
+        self.reconciled_at = None
+        self.attempted_at = None
+        self._task = None
+        self._reconcile_task = None
+
+    async def reconcile(self):
+        self.attempted_at = time.monotonic()
+        result = await self.db.query(STATEMENTS['reconcile_stats'])
+        if not result:
+            logger.warning("Stats reconciliation query failed; keeping running counters")
+            return
+        row = result[0]
+        self.users = int(row['users'])
+        self.guilds = int(row['guilds'])
+        self.total_points = int(row['total_points'])
+        self.active_users = int(row['active_users'])
+        self.reconciled_at = time.monotonic()
+
+    async def start(self, periodic=True):
+        if periodic:
+            await self.reconcile()
+            self._task = asyncio.create_task(self._reconcile_periodically())
+
+    def current(self):
+        """snapshot(); out of date counters are reconciled in the background for the next call"""
+        now = time.monotonic()
+        if ((self.reconciled_at is None or now - self.reconciled_at > self.interval) and
+                (self.attempted_at is None or now - self.attempted_at > self.interval) and
+                (self._reconcile_task is None or self._reconcile_task.done())):
+            self.attempted_at = now
+            self._reconcile_task = asyncio.create_task(self._reconcile_once())
+        return self.snapshot()
+
+    async def _reconcile_once(self):
+        try:
+            await self.reconcile()
+        except Exception as e:
+            logger.error(f"Stats reconciliation failed: {e}")
+
+    def close(self):
+        for task in (self._task, self._reconcile_task):
+            if task is not None:
+                task.cancel()
+
+    async def _reconcile_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Stats reconciliation failed: {e}")
+
+    def users_added(self, count=1):
+        self.users += count
+
+    def guilds_added(self, count=1):
+        self.guilds += count
+
+    def points_changed(self, before, delta):
+        """Record a points change for a user who had `before` points"""
+        after = before + delta
+        self.total_points += delta
+        if before <= 0 < after:
+            self.active_users += 1
+        elif after <= 0 < before:
+            self.active_users -= 1
+
+    def snapshot(self):
+        return {
+            'users': self.users,
+            'guilds': self.guilds,
+            'total_points': self.total_points,
+            'active_users': self.active_users,
+            'age': time.monotonic() - self.reconciled_at if self.reconciled_at is not None else None,
+        }
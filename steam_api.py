@@ -0,0 +1,426 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+
+import aiohttp
+
+from cache import TTLCache
+from metrics import metrics
+from ratelimit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, RateLimiter, RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+STEAM_API_BASE = os.getenv('STEAM_API_BASE', "https://api.steampowered.com")
+STEAM_STORE_BASE = os.getenv('STEAM_STORE_BASE', "https://store.steampowered.com")
+
+# Seconds a response stays fresh, per endpoint. Store data barely changes;
+# profile and play-time data go stale within minutes.
+STEAM_CACHE_TTLS = {
+    'ResolveVanityURL': 24 * 60 * 60,
+    'GetPlayerSummaries': 2 * 60,
+    'GetRecentlyPlayedGames': 5 * 60,
+    'appdetails': 6 * 60 * 60,
+}
+STEAM_CACHE_MAX_ENTRIES = int(os.getenv('STEAM_CACHE_MAX_ENTRIES', 5000))
+STEAM_CACHE_MAX_BYTES = int(os.getenv('STEAM_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# Vanity names rarely move, so stored mappings are served as-is and only
+# re-checked in the background once they are older than VANITY_REFRESH_AGE.
+VANITY_TTL = 24 * 60 * 60
+VANITY_NEGATIVE_TTL = 5 * 60
+VANITY_REFRESH_AGE = 7 * 24 * 60 * 60
+
+# GetPlayerSummaries takes up to 100 IDs; single lookups are held for a few
+# milliseconds so concurrent ones can share a call.
+SUMMARY_BATCH_SIZE = 100
+SUMMARY_BATCH_WINDOW = float(os.getenv('STEAM_SUMMARY_BATCH_WINDOW', 0.005))
+
+# One token bucket for every Steam call. The default sustained rate keeps us
+# under the 100k calls/day key quota; bursts are absorbed by the bucket.
+STEAM_RATE_LIMIT = float(os.getenv('STEAM_RATE_LIMIT', 1.1))
+STEAM_RATE_BURST = int(os.getenv('STEAM_RATE_BURST', 25))
+STEAM_MAX_QUEUE = int(os.getenv('STEAM_MAX_QUEUE', 200))
+# How long a request may wait for a token before failing, per priority
+QUEUE_TIMEOUTS = {PRIORITY_INTERACTIVE: 2.0, PRIORITY_BACKGROUND: 60.0}
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1.0
+
+# Background work (refreshes, prefetching) runs with PRIORITY_BACKGROUND so
+# interactive commands always get the next token first.
+request_priority = contextvars.ContextVar('steam_request_priority', default=PRIORITY_INTERACTIVE)
+
+
+class SteamAPIError(Exception):
+    """Raised when a Steam endpoint can't be reached or returns a bad response"""
+
+
+class SteamBusyError(SteamAPIError):
+    """Raised when a request can't get a rate limiter slot in time"""
+
+
+class SteamRateLimitedError(SteamAPIError):
+    """Raised when Steam keeps answering 429 after all retries"""
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key onto one in-flight coroutine"""
+
+    def __init__(self):
+        self._inflight = {}
+        self.shared = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def do(self, key, coro_factory):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        # Shielded so one caller timing out doesn't cancel the request for the rest
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every waiter went away
+
+
+class PlayerSummaryBatcher:
+    """Micro-batches profile lookups into GetPlayerSummaries calls of up to 100 IDs.
+
+    A lookup waits at most SUMMARY_BATCH_WINDOW seconds, or less once a full
+    batch is pending. Results are cached per player in the client's cache.
+    """
+
+    def __init__(self, client, window=SUMMARY_BATCH_WINDOW, max_batch=SUMMARY_BATCH_SIZE):
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}  # steam_id -> Future
+        self._timer = None
+        self._tasks = set()
+        self.requested = 0
+        self.batches = 0
+
+    @staticmethod
+    def cache_key(steam_id):
+        return 'PlayerSummary', steam_id
+
+    async def get(self, steam_id, refresh=False):
+        steam_id = str(steam_id)
+        if not refresh:
+            player = self.client.cache.get(self.cache_key(steam_id))
+            if player is not None:
+                return player or None  # {} marks a profile Steam didn't return
+        future = self._pending.get(steam_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._pending[steam_id] = future
+            self.requested += 1
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+        return await asyncio.shield(future)
+
+    async def get_many(self, steam_ids):
+        """Look up many profiles at once; they fill batches back to back"""
+        steam_ids = list(dict.fromkeys(str(s) for s in steam_ids))
+        players = await asyncio.gather(*(self.get(steam_id) for steam_id in steam_ids))
+        return dict(zip(steam_ids, players))
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch):
+        self.batches += 1
+        try:
+            players = await self.client.get_player_summaries(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        by_id = {player['steamid']: player for player in players}
+        ttl = STEAM_CACHE_TTLS['GetPlayerSummaries']
+        for steam_id, future in batch.items():
+            player = by_id.get(steam_id)
+            self.client.cache.set(self.cache_key(steam_id), player or {}, ttl=ttl)
+            if not future.done():
+                future.set_result(player)
+
+
+class SteamClient:
+    """Async Steam Web API client sharing one pooled, keep-alive HTTP session"""
+
+    def __init__(self, api_key, api_base=STEAM_API_BASE, store_base=STEAM_STORE_BASE,
+                 max_connections=100, timeout=10):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.store_base = store_base
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.session = None
+        self.cache = TTLCache(maxsize=STEAM_CACHE_MAX_ENTRIES, max_bytes=STEAM_CACHE_MAX_BYTES)
+        self.inflight = SingleFlight()
+        self.summaries = PlayerSummaryBatcher(self)
+        self.limiter = RateLimiter(STEAM_RATE_LIMIT, STEAM_RATE_BURST, max_queue=STEAM_MAX_QUEUE)
+
+    async def start(self):
+        """Open the shared HTTP session (call once the event loop is running)"""
+        if self.session is not None and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            ttl_dns_cache=300,
+            keepalive_timeout=30,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={'User-Agent': 'discordbot (aiohttp)'},
+        )
+        logger.info(f"Steam HTTP session opened (max {self.max_connections} connections)")
+
+    async def close(self):
+        """Close the shared HTTP session and its pooled connections"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            logger.info("Steam HTTP session closed")
+        self.session = None
+
+    @staticmethod
+    def cache_key(endpoint, params):
+        """Cache key for a request; the API key is left out so rotating it keeps the cache"""
+        return endpoint, tuple(sorted((k, str(v)) for k, v in params.items() if k != 'key'))
+
+    async def _get_json(self, endpoint, url, params, refresh=False, cached=True):
+        key = self.cache_key(endpoint, params)
+        if cached and not refresh:
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+        return await self.inflight.do(key, lambda: self._fetch(endpoint, key, url, params, cached))
+
+    async def _fetch(self, endpoint, key, url, params, cached=True):
+        if self.session is None or self.session.closed:
+            raise SteamAPIError("Steam client is not started")
+        params = {k: str(v) for k, v in params.items()}
+        body = await self._request(endpoint, url, params)
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise SteamAPIError(f"{endpoint} returned invalid JSON") from None
+        if cached:
+            self.cache.set(key, data, ttl=STEAM_CACHE_TTLS.get(endpoint), size=len(body))
+        return data
+
+    async def _request(self, endpoint, url, params):
+        """GET through the rate limiter, retrying 429s with jittered exponential backoff"""
+        priority = request_priority.get()
+        timeout = QUEUE_TIMEOUTS.get(priority, QUEUE_TIMEOUTS[PRIORITY_BACKGROUND])
+        for attempt in range(MAX_RETRIES + 1):
+            queued = time.perf_counter()
+            try:
+                await self.limiter.acquire(priority, timeout=timeout)
+            except RateLimitExceeded as e:
+                raise SteamBusyError(str(e)) from None
+            started = time.perf_counter()
+            metrics.observe('steam_queue', endpoint, started - queued)
+            try:
+                async with self.session.get(url, params=params) as resp:
+                    if resp.status == 429:
+                        retry_after = resp.headers.get('Retry-After')
+                    else:
+                        if resp.status >= 400:
+                            raise SteamAPIError(f"{endpoint} returned HTTP {resp.status}")
+                        return await resp.read()
+            except aiohttp.ClientError as e:
+                raise SteamAPIError(f"Couldn't reach Steam ({type(e).__name__})") from e
+            except asyncio.TimeoutError:
+                raise SteamAPIError(f"{endpoint} timed out") from None
+            finally:
+                metrics.observe('steam', endpoint, time.perf_counter() - started)
+
+            if attempt == MAX_RETRIES:
+                break
+            delay = RETRY_BASE_DELAY * 2 ** attempt
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            self.limiter.pause(delay)
+            logger.warning(f"Steam {endpoint} returned 429, retry {attempt + 1}/{MAX_RETRIES} in ~{delay}s")
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+        raise SteamRateLimitedError(f"{endpoint} is rate limited by Steam")
+
+    async def resolve_vanity_url(self, vanity, refresh=False):
+        """Return the SteamID64 for a vanity name, or None if Steam doesn't know it"""
+        url = f"{self.api_base}/ISteamUser/ResolveVanityURL/v1/"
+        params = {'key': self.api_key, 'vanityurl': vanity}
+        data = await self._get_json('ResolveVanityURL', url, params, refresh=refresh)
+        if data['response']['success'] != 1:
+            # A miss may be a typo or a profile that doesn't exist yet; don't hold it for a day
+            key = self.cache_key('ResolveVanityURL', params)
+            left = self.cache.ttl_left(key)
+            if left is not None and left > VANITY_NEGATIVE_TTL:
+                self.cache.set(key, data, ttl=VANITY_NEGATIVE_TTL)
+            return None
+        return data['response']['steamid']
+
+    async def get_player_summaries(self, steam_ids):
+        """Return the raw GetPlayerSummaries player list for up to 100 SteamID64s.
+
+        Uncached: per-player results are cached by PlayerSummaryBatcher instead.
+        """
+        url = f"{self.api_base}/ISteamUser/GetPlayerSummaries/v0002/"
+        data = await self._get_json('GetPlayerSummaries', url,
+                                    {'key': self.api_key, 'steamids': ",".join(steam_ids)}, cached=False)
+        return data.get('response', {}).get('players', [])
+
+    async def get_player_summary(self, steam_id):
+        """Return a single player summary, or None if the profile doesn't exist"""
+        return await self.summaries.get(steam_id)
+
+    async def get_player_summaries_bulk(self, steam_ids):
+        """Return {steam_id: summary or None} for any number of SteamID64s"""
+        return await self.summaries.get_many(steam_ids)
+
+    async def get_recently_played_games(self, steam_id, count=5, refresh=False):
+        """Return the GetRecentlyPlayedGames game list for a SteamID64"""
+        url = f"{self.api_base}/IPlayerService/GetRecentlyPlayedGames/v0001/"
+        data = await self._get_json('GetRecentlyPlayedGames', url, {'key': self.api_key, 'steamid': steam_id, 'count': count},
+                                    refresh=refresh)
+        return data.get('response', {}).get('games', [])
+
+    async def get_app_details(self, app_id, refresh=False):
+        """Return store data for an app ID, or None if the store has no such app"""
+        url = f"{self.store_base}/api/appdetails"
+        data = await self._get_json('appdetails', url, {'appids': app_id, 'format': 'json'}, refresh=refresh)
+        return self._app_data(app_id, data)
+
+    @staticmethod
+    def _app_data(app_id, data):
+        if not data or app_id not in data or not data[app_id]['success']:
+            return None
+        return data[app_id]['data']
+
+    # ---------- CACHE PEEKS ----------
+    # These never touch the network. Each returns (value, is_fresh) from the
+    # cache, stale entries included, or None if nothing is cached.
+
+    def recently_played_key(self, steam_id, count=5):
+        return self.cache_key('GetRecentlyPlayedGames', {'steamid': steam_id, 'count': count})
+
+    def app_details_key(self, app_id):
+        return self.cache_key('appdetails', {'appids': app_id, 'format': 'json'})
+
+    def peek_player_summary(self, steam_id):
+        hit = self.cache.peek(PlayerSummaryBatcher.cache_key(str(steam_id)))
+        if hit is None:
+            return None
+        player, fresh = hit
+        return player or None, fresh
+
+    def peek_recently_played_games(self, steam_id, count=5):
+        hit = self.cache.peek(self.recently_played_key(steam_id, count))
+        if hit is None:
+            return None
+        data, fresh = hit
+        return data.get('response', {}).get('games', []), fresh
+
+    def peek_app_details(self, app_id):
+        hit = self.cache.peek(self.app_details_key(app_id))
+        if hit is None:
+            return None
+        data, fresh = hit
+        return self._app_data(app_id, data), fresh
+
+
+class VanityResolver:
+    """Vanity name -> SteamID64 lookups backed by an in-process cache and a MySQL table.
+
+    Misses are cached briefly so typos don't hammer ResolveVanityURL. If the
+    store is None (database down) lookups fall back to the Steam API alone.
+    """
+
+    def __init__(self, client, store=None):
+        self.client = client
+        self.store = store
+        self.cache = TTLCache(maxsize=10000, default_ttl=VANITY_TTL)
+        self.inflight = SingleFlight()
+        self._refreshing = {}
+
+    async def resolve(self, vanity):
+        key = vanity.lower()
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached or None  # '' marks a cached miss
+        return await self.inflight.do(key, lambda: self._resolve(key))
+
+    async def _resolve(self, key):
+        if self.store is not None:
+            try:
+                row = await self.store.get_vanity(key)
+            except Exception as e:
+                logger.error(f"Error reading vanity '{key}' from database: {e}")
+                row = None
+            if row:
+                steam_id = str(row['steam_id'])
+                self.cache.set(key, steam_id)
+                if row['age'] is not None and row['age'] > VANITY_REFRESH_AGE:
+                    self._schedule_refresh(key)
+                return steam_id
+
+        return await self._fetch(key)
+
+    async def _fetch(self, key, refresh=False):
+        steam_id = await self.client.resolve_vanity_url(key, refresh=refresh)
+        if steam_id is None:
+            self.cache.set(key, '', ttl=VANITY_NEGATIVE_TTL)
+            if refresh and self.store is not None:
+                # The stored mapping is gone on Steam's side too
+                try:
+                    await self.store.delete_vanity(key)
+                except Exception as e:
+                    logger.error(f"Error deleting vanity '{key}' from database: {e}")
+            return None
+        self.cache.set(key, steam_id)
+        if self.store is not None:
+            try:
+                await self.store.save_vanity(key, steam_id)
+            except Exception as e:
+                logger.error(f"Error saving vanity '{key}' to database: {e}")
+        return steam_id
+
+    def _schedule_refresh(self, key):
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(key))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _refresh(self, key):
+        request_priority.set(PRIORITY_BACKGROUND)
+        try:
+            steam_id = await self._fetch(key, refresh=True)
+            logger.info(f"Refreshed vanity '{key}' -> {steam_id}")
+        except Exception as e:
+            logger.warning(f"Background refresh of vanity '{key}' failed: {e}")
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from cache import TTLCache
+from ratelimit import PRIORITY_BACKGROUND
+from steam_api import SUMMARY_BATCH_SIZE, SteamAPIError, SteamBusyError, SteamRateLimitedError, request_priority
+
+logger = logging.getLogger(__name__)
+
+# Every linked account is snapshotted once per SNAPSHOT_INTERVAL; commands
+# treat snapshots up to SNAPSHOT_MAX_AGE old as current.
+SNAPSHOT_INTERVAL = int(os.getenv('STEAM_SNAPSHOT_INTERVAL', 60 * 60))
+SNAPSHOT_MAX_AGE = int(os.getenv('STEAM_SNAPSHOT_MAX_AGE', 2 * SNAPSHOT_INTERVAL))
+# Recently played games are one request per account; this many wait for a token at once
+SNAPSHOT_CONCURRENCY = 4
+LINK_CACHE_TTL = 10 * 60
+
+
+class LinkedAccounts:
+    """Discord user -> Steam account links and scheduled snapshots of every linked account.
+
+    Links live in steam_links, with lookups cached in process. A sweep
+    snapshots profiles (100 per GetPlayerSummaries call) and recently played
+    games for all linked accounts into steam_snapshots, at
+    PRIORITY_BACKGROUND so commands keep the next rate limiter token.
+    Commands read those snapshots instead of waiting on Steam.
+    """
+
+    def __init__(self, client, store, interval=SNAPSHOT_INTERVAL, max_age=SNAPSHOT_MAX_AGE,
+                 concurrency=SNAPSHOT_CONCURRENCY):
+        self.client = client
+        self.store = store
+        self.interval = interval
+        self.max_age = max_age
+        self.concurrency = concurrency
+        self.links = TTLCache(maxsize=10000, default_ttl=LINK_CACHE_TTL)  # discord_id -> steam_id, '' if none
+        self._task = None
+        self._refreshing = set()
+        # stats
+        self.sweeps = 0
+        self.last_sweep = None  # (accounts, rows written, seconds)
+
+    @property
+    def available(self):
+        return self.store is not None
+
+    # ---------- LINKS ----------
+    async def get(self, discord_id):
+        """The SteamID64 linked to a Discord user, or None"""
+        steam_id = self.links.get(discord_id)
+        if steam_id is None:
+            steam_id = await self.store.get_link(discord_id) or ''
+            self.links.set(discord_id, steam_id)
+        return steam_id or None
+
+    async def link(self, discord_id, steam_id):
+        await self.store.save_link(discord_id, steam_id)
+        self.links.set(discord_id, steam_id)
+        self.refresh_soon(steam_id)
+
+    async def unlink(self, discord_id):
+        removed = await self.store.delete_link(discord_id)
+        self.links.set(discord_id, '')
+        return removed > 0
+
+    # ---------- SNAPSHOTS ----------
+    async def snapshot(self, steam_id, part):
+        """(value, is_current, age in seconds) for a snapshot part ('summary' or 'games'), or None.
+
+        The first two items are shaped like SteamClient's cache peeks, so
+        respond_progressively can show an old snapshot and then refresh it.
+        """
+        row = await self.store.get_snapshot(steam_id)
+        if row is None or row[part] is None or row[f'{part}_age'] is None:
+            return None
+        age = row[f'{part}_age']
+        return json.loads(row[part]), age <= self.max_age, age
+
+    def refresh_soon(self, steam_id):
+        """Snapshot one account in the background, e.g. right after it was linked"""
+        if steam_id in self._refreshing:
+            return
+        self._refreshing.add(steam_id)
+        task = asyncio.create_task(self.refresh([steam_id]))
+        task.add_done_callback(lambda t: self._refreshed(steam_id, t))
+
+    def _refreshed(self, steam_id, task):
+        self._refreshing.discard(steam_id)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Snapshot of {steam_id} failed: {task.exception()}")
+
+    async def _games(self, steam_id, semaphore):
+        async with semaphore:
+            try:
+                return await self.client.get_recently_played_games(steam_id, count=5, refresh=True)
+            except (SteamBusyError, SteamRateLimitedError):
+                raise
+            except SteamAPIError as e:
+                logger.debug(f"Snapshot of games for {steam_id} failed: {e}")
+                return None
+
+    async def refresh(self, steam_ids):
+        """Snapshot the given accounts in batches of 100; returns accounts written.
+
+        A batch whose calls fail keeps the previous snapshot parts. Stops
+        early when Steam or the rate limiter pushes back.
+        """
+        request_priority.set(PRIORITY_BACKGROUND)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        written = 0
+        for i in range(0, len(steam_ids), SUMMARY_BATCH_SIZE):
+            batch = steam_ids[i:i + SUMMARY_BATCH_SIZE]
+            try:
+                summaries = await self.client.get_player_summaries_bulk(batch)
+                games = await asyncio.gather(*(self._games(steam_id, semaphore) for steam_id in batch))
+            except (SteamBusyError, SteamRateLimitedError) as e:
+                logger.warning(f"Snapshot sweep stopped after {i} accounts: {e}")
+                break
+            except SteamAPIError as e:
+                logger.warning(f"Snapshot batch of {len(batch)} accounts failed: {e}")
+                continue
+            rows = [(steam_id,
+                     json.dumps(summaries.get(steam_id) or {}),
+                     json.dumps(played) if played is not None else None)
+                    for steam_id, played in zip(batch, games)]
+            await self.store.save_snapshots(rows)
+            written += len(rows)
+        return written
+
+    async def sweep(self):
+        started = time.perf_counter()
+        steam_ids = await self.store.linked_steam_ids()
+        written = await self.refresh(steam_ids)
+        elapsed = time.perf_counter() - started
+        self.sweeps += 1
+        self.last_sweep = (len(steam_ids), written, elapsed)
+        logger.info(f"Snapshot sweep: {len(steam_ids)} linked accounts, {written} rows in {elapsed:.1f}s")
+
+    # ---------- LIFECYCLE ----------
+    def start(self, sweep=True):
+        """Start the scheduled sweep; only one process in a sharded deployment should run it"""
+        if sweep:
+            self._task = asyncio.create_task(self._sweep_periodically())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _sweep_periodically(self):
+        while True:
+            started = time.monotonic()
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Snapshot sweep failed: {e}")
+            # A sweep longer than the interval is followed straight away by the next
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from ratelimit import PRIORITY_BACKGROUND
+from steam_api import (STEAM_CACHE_TTLS, SUMMARY_BATCH_SIZE, PlayerSummaryBatcher, SteamAPIError,
+                       SteamBusyError, request_priority)
+
+logger = logging.getLogger(__name__)
+
+# Warm items kept per kind, and the Steam requests per hour prefetching may use
+PREFETCH_SIZE = int(os.getenv('STEAM_PREFETCH_SIZE', 200))
+PREFETCH_BUDGET = float(os.getenv('STEAM_PREFETCH_BUDGET', 600))
+# A lookup's weight halves every PREFETCH_HALF_LIFE seconds
+PREFETCH_HALF_LIFE = float(os.getenv('STEAM_PREFETCH_HALF_LIFE', 6 * 60 * 60))
+PREFETCH_INTERVAL = 30
+# Entries are refreshed once less than this share of their TTL is left
+PREFETCH_LEAD = 0.25
+PERSIST_INTERVAL = 5 * 60
+
+# kind -> endpoint whose TTL applies
+KINDS = {
+    'app': 'appdetails',
+    'player': 'GetPlayerSummaries',
+    'games': 'GetRecentlyPlayedGames',
+}
+
+
+class Prefetcher:
+    """Keeps the most requested Steam lookups warm in the client's cache.
+
+    Commands record() what they look up: app IDs, player profiles and
+    recently played games. Popularity is a hit count that decays with a
+    half-life. Every `interval` the top `size` items of each kind whose cache
+    entries are missing or close to expiry are refreshed at
+    PRIORITY_BACKGROUND, only while the shared rate limiter is idle and within
+    `budget` Steam requests per hour. The warm set, payloads included, is
+    saved to steam_warm so a restart begins with a warm cache.
+    """
+
+    def __init__(self, client, store=None, size=PREFETCH_SIZE, budget=PREFETCH_BUDGET,
+                 interval=PREFETCH_INTERVAL, half_life=PREFETCH_HALF_LIFE, lead=PREFETCH_LEAD,
+                 clock=time.time):
+        self.client = client
+        self.store = store
+        self.size = size
+        self.budget = budget
+        self.interval = interval
+        self.half_life = half_life
+        self.lead = lead
+        self.clock = clock
+        self.scores = {}  # (kind, key) -> (score, last_seen)
+        self.warm = set()  # (kind, key) in the current top set
+        self.allowance = budget / 12  # at most five minutes of budget in one go
+        self.updated = clock()
+        self._task = None
+        # stats
+        self.popular_lookups = 0
+        self.served_locally = 0
+        self.refreshed = 0
+        self.requests = 0
+        self.busy_skips = 0
+
+    def cache_key(self, kind, key):
+        if kind == 'app':
+            return self.client.app_details_key(key)
+        if kind == 'player':
+            return PlayerSummaryBatcher.cache_key(key)
+        return self.client.recently_played_key(key)
+
+    def _decayed(self, score, last_seen, now):
+        return score * 0.5 ** (max(0.0, now - last_seen) / self.half_life)
+
+    def record(self, kind, key):
+        """Count a lookup; call before serving it so cache hits on the warm set are measured"""
+        item = (kind, str(key))
+        if item in self.warm:
+            self.popular_lookups += 1
+            if self.cache_key(*item) in self.client.cache:
+                self.served_locally += 1
+        now = self.clock()
+        score, last_seen = self.scores.get(item, (0.0, now))
+        self.scores[item] = (self._decayed(score, last_seen, now) + 1, now)
+        if len(self.scores) > 20 * self.size:
+            self._trim(now)
+
+    def _trim(self, now):
+        """Drop the long tail, keeping a few times the warm set per kind"""
+        keep = set()
+        for kind in KINDS:
+            keep.update((kind, key) for key, _ in self.top(kind, now, limit=5 * self.size))
+        self.scores = {item: value for item, value in self.scores.items() if item in keep}
+
+    def top(self, kind, now=None, limit=None):
+        """[(key, decayed score)] of a kind, most popular first"""
+        now = self.clock() if now is None else now
+        rows = [(key, self._decayed(score, last_seen, now))
+                for (item_kind, key), (score, last_seen) in self.scores.items() if item_kind == kind]
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return rows[:limit or self.size]
+
+    def due(self, now=None):
+        """Warm items to refresh, most popular first, as (score, kind, key); also updates the warm set"""
+        now = self.clock() if now is None else now
+        warm = set()
+        due = []
+        for kind, endpoint in KINDS.items():
+            threshold = self.lead * STEAM_CACHE_TTLS[endpoint]
+            for key, score in self.top(kind, now):
+                warm.add((kind, key))
+                left = self.client.cache.ttl_left(self.cache_key(kind, key))
+                if left is None or left < threshold:
+                    due.append((score, kind, key))
+        self.warm = warm
+        due.sort(reverse=True)
+        return due
+
+    def _refill(self):
+        now = self.clock()
+        self.allowance = min(self.budget / 12, self.allowance + (now - self.updated) * self.budget / 3600)
+        self.updated = now
+
+    def _quiet(self):
+        # Leave half the burst for interactive commands
+        return self.client.limiter.idle(reserve=self.client.limiter.burst / 2)
+
+    async def run_once(self):
+        """One prefetch cycle; returns how many items were refreshed"""
+        self._refill()
+        due = self.due()
+        players = []
+        reserved = 0.0  # allowance held for the profile batch, only spent if it goes out
+        refreshed = 0
+        for _, kind, key in due:
+            if kind == 'player':
+                # Profiles go out 100 to a request
+                cost = 1 / SUMMARY_BATCH_SIZE
+                if self.allowance - reserved < cost:
+                    break
+                reserved += cost
+                players.append(key)
+                continue
+            if self.allowance - reserved < 1:
+                break
+            if not self._quiet():
+                self.busy_skips += 1
+                break
+            self.allowance -= 1
+            try:
+                if kind == 'app':
+                    await self.client.get_app_details(key, refresh=True)
+                else:
+                    await self.client.get_recently_played_games(key, count=5, refresh=True)
+            except SteamBusyError:
+                self.busy_skips += 1
+                break
+            except SteamAPIError as e:
+                logger.debug(f"Prefetching {kind} {key} failed: {e}")
+                continue
+            finally:
+                self.requests += 1
+            refreshed += 1
+
+        if players and not self._quiet():
+            self.busy_skips += 1
+        elif players:
+            self.allowance -= reserved
+            results = await asyncio.gather(*(self.client.summaries.get(steam_id, refresh=True)
+                                             for steam_id in players), return_exceptions=True)
+            self.requests += -(-len(players) // SUMMARY_BATCH_SIZE)
+            refreshed += sum(1 for result in results if not isinstance(result, Exception))
+        self.refreshed += refreshed
+        return refreshed
+
+    # ---------- PERSISTENCE ----------
+    async def load(self):
+        """Restore the saved warm set and seed the cache with its payloads (stale ones included)"""
+        rows = await self.store.load_warm(3 * self.size * len(KINDS)) or []
+        now = self.clock()
+        seeded = 0
+        for row in rows:
+            kind, key = row['kind'], row['item_key']
+            if kind not in KINDS:
+                continue
+            self.scores[(kind, key)] = (row['score'], now)
+            if row['data'] is None or row['age'] is None:
+                continue
+            # Expired payloads are still cached (as stale) for progressive responses
+            ttl = max(0, STEAM_CACHE_TTLS[KINDS[kind]] - row['age'])
+            self.client.cache.set(self.cache_key(kind, key), json.loads(row['data']), ttl=ttl)
+            seeded += 1
+        self.due(now)
+        logger.info(f"Loaded {len(rows)} prefetch items, {seeded} cached payloads")
+
+    def _warm_rows(self):
+        now = self.clock()
+        rows = []
+        for kind, endpoint in KINDS.items():
+            ttl = STEAM_CACHE_TTLS[endpoint]
+            for key, score in self.top(kind, now):
+                cache_key = self.cache_key(kind, key)
+                hit = self.client.cache.peek(cache_key)
+                left = self.client.cache.ttl_left(cache_key)
+                if hit is None:
+                    rows.append((kind, key, score, None, None))
+                else:
+                    rows.append((kind, key, score, json.dumps(hit[0]), now - (ttl - left)))
+        return rows
+
+    async def save(self):
+        saved = await self.store.save_warm(self._warm_rows())
+        await self.store.prune_warm()
+        return saved
+
+    # ---------- LIFECYCLE ----------
+    async def start(self):
+        if self.store is not None:
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"Couldn't load the prefetch warm set: {e}")
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            if self.store is not None:
+                try:
+                    await self.save()
+                except Exception as e:
+                    logger.error(f"Couldn't save the prefetch warm set: {e}")
+
+    async def _run(self):
+        request_priority.set(PRIORITY_BACKGROUND)
+        last_saved = self.clock()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                refreshed = await self.run_once()
+                if refreshed:
+                    logger.debug(f"Prefetched {refreshed} Steam items")
+                if self.store is not None and self.clock() - last_saved >= PERSIST_INTERVAL:
+                    last_saved = self.clock()
+                    await self.save()
+            except Exception as e:
+                logger.error(f"Steam prefetch cycle failed: {e}")
+
+    def stats(self):
+        return {
+            'tracked': len(self.scores),
+            'warm': len(self.warm),
+            'refreshed': self.refreshed,
+            'requests': self.requests,
+            'busy_skips': self.busy_skips,
+            'popular_lookups': self.popular_lookups,
+            'local_rate': self.served_locally / self.popular_lookups if self.popular_lookups else 0.0,
+        }
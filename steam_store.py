@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import os
+
+import pymysql
+import pymysql.cursors
+
+from db_pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+def _connect(config):
+    return pymysql.connect(**config, autocommit=True, cursorclass=pymysql.cursors.DictCursor)
+
+
+class SteamStore:
+    """MySQL persistence for the Steam bot.
+
+    Connections come from a small ConnectionPool opened in start(); every
+    call runs in a worker thread, off the event loop.
+    """
+
+    def __init__(self, min_size=1, max_size=4, timeout=10.0, **connect_kwargs):
+        self.connect_kwargs = connect_kwargs
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pool = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            min_size=int(os.getenv('DB_POOL_MIN', 1)),
+            max_size=int(os.getenv('DB_POOL_MAX', 4)),
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+            host=os.getenv('MYSQLHOST'),
+            port=int(os.getenv('MYSQLPORT', 3306)),
+            user=os.getenv('MYSQLUSER'),
+            password=os.getenv('MYSQLPASSWORD'),
+            db=os.getenv('MYSQLDATABASE'),
+        )
+
+    def _execute(self, query, params=None, fetch=False):
+        connection = self.pool.get_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(query, params or ())
+                return cursor.fetchall() if fetch else cursor.rowcount
+        finally:
+            connection.close()
+
+    def _execute_many(self, query, rows):
+        connection = self.pool.get_connection()
+        try:
+            with connection.cursor() as cursor:
+                return cursor.executemany(query, rows) or 0
+        finally:
+            connection.close()
+
+    async def query(self, query, params=None):
+        """Run a SELECT in a worker thread and return its rows"""
+        return await asyncio.to_thread(self._execute, query, params, True)
+
+    async def update(self, query, params=None):
+        """Run an INSERT/UPDATE/DELETE in a worker thread and return the row count"""
+        return await asyncio.to_thread(self._execute, query, params)
+
+    async def update_many(self, query, rows):
+        """Run one INSERT/UPDATE per row (batched by executemany) in a worker thread"""
+        if not rows:
+            return 0
+        return await asyncio.to_thread(self._execute_many, query, rows)
+
+    def create_tables(self):
+        """Create necessary tables"""
+        tables = {
+            'steam_vanity': """
+                CREATE TABLE IF NOT EXISTS steam_vanity (
+                    vanity VARCHAR(64) PRIMARY KEY,
+                    steam_id BIGINT UNSIGNED NOT NULL,
+                    resolved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                )
+            """,
+            'steam_links': """
+                CREATE TABLE IF NOT EXISTS steam_links (
+                    discord_id BIGINT UNSIGNED PRIMARY KEY,
+                    steam_id BIGINT UNSIGNED NOT NULL,
+                    linked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_steam_id (steam_id)
+                )
+            """,
+            'steam_snapshots': """
+                CREATE TABLE IF NOT EXISTS steam_snapshots (
+                    steam_id BIGINT UNSIGNED PRIMARY KEY,
+                    summary TEXT NULL,
+                    games TEXT NULL,
+                    summary_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+                    games_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+                    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    INDEX idx_refreshed_at (refreshed_at)
+                )
+            """,
+            'steam_warm': """
+                CREATE TABLE IF NOT EXISTS steam_warm (
+                    kind VARCHAR(16) NOT NULL,
+                    item_key VARCHAR(32) NOT NULL,
+                    score DOUBLE NOT NULL,
+                    data MEDIUMTEXT NULL,
+                    fetched_at TIMESTAMP NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    PRIMARY KEY (kind, item_key),
+                    INDEX idx_score (score)
+                )
+            """,
+        }
+        for table_name, create_query in tables.items():
+            self._execute(create_query)
+            logger.info(f"Table '{table_name}' created/verified successfully")
+
+        # Columns added after the tables first shipped
+        added = [self.ensure_column('steam_snapshots', column, 'TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP')
+                 for column in ('summary_at', 'games_at')]
+        if any(added):
+            # Older rows only know when either part was last written
+            self._execute("UPDATE steam_snapshots SET summary_at = refreshed_at, games_at = refreshed_at")
+
+    def ensure_column(self, table, column, definition):
+        """Add a column to an existing table unless it's already there; returns whether it was added"""
+        existing = self._execute(
+            """SELECT 1 FROM information_schema.columns
+               WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+               LIMIT 1""",
+            (table, column), fetch=True
+        )
+        if existing:
+            return False
+        self._execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logger.info(f"Column '{column}' added to '{table}'")
+        return True
+
+    def _open(self):
+        self.pool = ConnectionPool(self.connect_kwargs, min_size=self.min_size, max_size=self.max_size,
+                                   timeout=self.timeout, connect=_connect)
+        logger.info(f"Steam database pool opened ({self.min_size}-{self.max_size} connections)")
+        self.create_tables()
+
+    async def start(self):
+        await asyncio.to_thread(self._open)
+
+    async def close(self):
+        if self.pool is not None:
+            await asyncio.to_thread(self.pool.close)
+            self.pool = None
+
+    # ---------- VANITY URLS ----------
+    async def get_vanity(self, vanity):
+        """Return {'steam_id', 'age'} for a stored vanity name (age in seconds), or None"""
+        rows = await self.query(
+            """SELECT steam_id, TIMESTAMPDIFF(SECOND, resolved_at, NOW()) AS age
+               FROM steam_vanity WHERE vanity = %s""",
+            (vanity,)
+        )
+        return rows[0] if rows else None
+
+    async def save_vanity(self, vanity, steam_id):
+        await self.update(
+            """INSERT INTO steam_vanity (vanity, steam_id) VALUES (%s, %s)
+               ON DUPLICATE KEY UPDATE
+               steam_id = VALUES(steam_id),
+               resolved_at = CURRENT_TIMESTAMP""",
+            (vanity, steam_id)
+        )
+
+    async def delete_vanity(self, vanity):
+        return await self.update("DELETE FROM steam_vanity WHERE vanity = %s", (vanity,))
+
+    # ---------- LINKED ACCOUNTS ----------
+    async def get_link(self, discord_id):
+        rows = await self.query("SELECT steam_id FROM steam_links WHERE discord_id = %s", (discord_id,))
+        return str(rows[0]['steam_id']) if rows else None
+
+    async def save_link(self, discord_id, steam_id):
+        await self.update(
+            """INSERT INTO steam_links (discord_id, steam_id) VALUES (%s, %s)
+               ON DUPLICATE KEY UPDATE
+               steam_id = VALUES(steam_id),
+               linked_at = CURRENT_TIMESTAMP""",
+            (discord_id, steam_id)
+        )
+
+    async def delete_link(self, discord_id):
+        return await self.update("DELETE FROM steam_links WHERE discord_id = %s", (discord_id,))
+
+    async def linked_steam_ids(self):
+        """Every linked SteamID64, least recently snapshotted first"""
+        rows = await self.query(
+            """SELECT l.steam_id
+               FROM (SELECT DISTINCT steam_id FROM steam_links) l
+               LEFT JOIN steam_snapshots s ON s.steam_id = l.steam_id
+               ORDER BY s.refreshed_at IS NOT NULL, s.refreshed_at"""
+        )
+        return [str(row['steam_id']) for row in rows]
+
+    # ---------- SNAPSHOTS ----------
+    async def get_snapshot(self, steam_id):
+        """Return {'summary', 'games', 'summary_age', 'games_age'} (JSON text, seconds) for a SteamID64, or None"""
+        rows = await self.query(
+            """SELECT summary, games,
+                      TIMESTAMPDIFF(SECOND, summary_at, NOW()) AS summary_age,
+                      TIMESTAMPDIFF(SECOND, games_at, NOW()) AS games_age
+               FROM steam_snapshots WHERE steam_id = %s""",
+            (steam_id,)
+        )
+        return rows[0] if rows else None
+
+    async def save_snapshots(self, rows):
+        """Upsert (steam_id, summary JSON, games JSON) rows; a None part keeps the stored one and its age"""
+        return await self.update_many(
+            """INSERT INTO steam_snapshots (steam_id, summary, games) VALUES (%s, %s, %s)
+               ON DUPLICATE KEY UPDATE
+               summary_at = IF(VALUES(summary) IS NULL, summary_at, CURRENT_TIMESTAMP),
+               games_at = IF(VALUES(games) IS NULL, games_at, CURRENT_TIMESTAMP),
+               summary = COALESCE(VALUES(summary), summary),
+               games = COALESCE(VALUES(games), games),
+               refreshed_at = CURRENT_TIMESTAMP""",
+            rows
+        )
+
+    # ---------- PREFETCH WARM SET ----------
+    async def load_warm(self, limit):
+        """The `limit` highest scored warm items, each with its payload's age in seconds"""
+        return await self.query(
+            """SELECT kind, item_key, score, data, TIMESTAMPDIFF(SECOND, fetched_at, NOW()) AS age
+               FROM steam_warm ORDER BY score DESC LIMIT %s""",
+            (limit,)
+        )
+
+    async def save_warm(self, rows):
+        """Upsert (kind, item_key, score, data, fetched_at unix time) rows"""
+        return await self.update_many(
+            """INSERT INTO steam_warm (kind, item_key, score, data, fetched_at)
+               VALUES (%s, %s, %s, %s, FROM_UNIXTIME(%s))
+               ON DUPLICATE KEY UPDATE
+               score = VALUES(score),
+               data = COALESCE(VALUES(data), data),
+               fetched_at = COALESCE(VALUES(fetched_at), fetched_at),
+               updated_at = CURRENT_TIMESTAMP""",
+            rows
+        )
+
+    async def prune_warm(self, days=7):
+        """Forget items no process has saved for `days`"""
+        return await self.update(
+            "DELETE FROM steam_warm WHERE updated_at < NOW() - INTERVAL %s DAY",
+            (days,)
+        )
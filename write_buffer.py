@@ -0,0 +1,388 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db_statements import STATEMENTS
+
+logger = logging.getLogger(__name__)
+
+# users.points, guild_points.points and activity_log.amount are INT columns
+POINTS_MIN = -2 ** 31
+POINTS_MAX = 2 ** 31 - 1
+# How often applied batch ids older than any replayable journal are deleted
+PRUNE_INTERVAL = 60 * 60
+
+
+class _Batch:
+    """Buffered writes merged per user: last name wins, points deltas add up"""
+
+    def __init__(self):
+        self.users = {}  # user_id -> [username, display_name]
+        self.points = {}  # user_id -> [delta, username, display_name]
+        self.guild_points = {}  # (guild_id, user_id) -> delta
+        self.activity = []  # (user_id, guild_id, activity_type, amount, created_at)
+        self.rollups = {}  # (day, guild_id, user_id, activity_type) -> [events, amount]
+        self.ops = 0
+
+    def __bool__(self):
+        return self.ops > 0
+
+    def apply(self, op):
+        user_id = op['user_id']
+        if op['op'] == 'user':
+            entry = self.users.setdefault(user_id, [op['username'], None])
+            entry[0] = op['username']
+            if op.get('display_name') is not None:
+                entry[1] = op['display_name']
+        elif op['op'] == 'points':
+            entry = self.points.setdefault(user_id, [0, op['username'], op['display_name']])
+            entry[0] += op['amount']
+            if op['guild_id'] is not None:
+                key = (op['guild_id'], user_id)
+                self.guild_points[key] = self.guild_points.get(key, 0) + op['amount']
+                self.add_activity(user_id, op['guild_id'], 'points_added', op['amount'], op.get('at'))
+        self.ops += 1
+
+    def add_activity(self, user_id, guild_id, activity_type, amount, at=None):
+        created_at = datetime.datetime.fromtimestamp(at or time.time(), datetime.timezone.utc).replace(tzinfo=None)
+        self.activity.append((user_id, guild_id, activity_type, amount, created_at))
+        rollup = self.rollups.setdefault((created_at.date(), guild_id, user_id, activity_type), [0, 0])
+        rollup[0] += 1
+        rollup[1] += amount or 0
+
+    def rows(self):
+        return len(self.users) + len(self.points) + len(self.guild_points) + len(self.activity) + len(self.rollups)
+
+    def statements(self, batch_id):
+        return [
+            (STATEMENTS['upsert_user_names'], [(user_id, *names) for user_id, names in self.users.items()]),
+            (STATEMENTS['add_points'], [(user_id, username, display_name, delta)
+                                        for user_id, (delta, username, display_name) in self.points.items()]),
+            (STATEMENTS['add_guild_points'], [(guild_id, user_id, delta)
+                                              for (guild_id, user_id), delta in self.guild_points.items()]),
+            (STATEMENTS['insert_activity'], self.activity),
+            (STATEMENTS['rollup_activity'], [(*key, events, amount)
+                                             for key, (events, amount) in self.rollups.items()]),
+            (STATEMENTS['mark_batch_applied'], [(batch_id,)]),
+        ]
+
+
+def _batch_of(ops):
+    batch = _Batch()
+    for op in ops:
+        batch.apply(op)
+    return batch
+
+
+class WriteBehindBuffer:
+    """Buffers user/points writes and flushes them as one merged transaction.
+
+    Every write is appended to a local journal segment (and fsynced) before it
+    is acknowledged. A flush rotates the segment and commits the batch together
+    with its segment id in write_batches, so replaying journals after a crash
+    never applies a batch twice. A batch the database rejects max_rejections
+    times (bad data rather than an outage) is retried one journaled write at
+    a time, each committed under its own id, and only the writes rejected on
+    their own are moved to the dead_letter directory and passed to
+    on_dead_letter(op).
+
+    Applied ids are pruned once they are older than every segment this
+    process could still replay and older than keep_applied_days, which covers
+    the journals of other processes sharing the table.
+    """
+
+    def __init__(self, db, journal_dir='write_journal', max_pending=500, flush_interval=2.0, max_rejections=5,
+                 on_dead_letter=None, keep_applied_days=7):
+        self.db = db
+        self.journal_dir = journal_dir
+        self.dead_letter_dir = os.path.join(journal_dir, 'dead_letter')
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.max_rejections = max_rejections
+        self.on_dead_letter = on_dead_letter
+        self.keep_applied_days = keep_applied_days
+        self.pending = _Batch()
+        self._failed = []  # (batch_id, _Batch, rejections) kept on disk until a retry succeeds
+        self._segment_id = None
+        self._segment = None
+        # One thread so journal appends and rotations happen in order
+        self._journal_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='journal')
+        self._flush_lock = asyncio.Lock()
+        # Held while journaling + buffering an op and while swapping batches, so
+        # every op lands in the same segment as the batch that commits it
+        self._swap_lock = asyncio.Lock()
+        self._flush_task = None
+        self._timer_task = None
+        self._unflushed = {}  # user_id -> points not yet committed to MySQL
+        # Odd while a batch may be committed but not yet subtracted from _unflushed
+        self.flush_version = 0
+        # metrics
+        self.ops_buffered = 0
+        self.rows_written = 0
+        self.flushes = 0
+        self.dead_letters = 0
+
+    # ---------- JOURNAL ----------
+    def _segment_path(self, batch_id):
+        return os.path.join(self.journal_dir, f"{batch_id}.jsonl")
+
+    def _open_segment(self):
+        self._segment_id = str(time.time_ns())
+        self._segment = open(self._segment_path(self._segment_id), 'a', encoding='utf-8')
+
+    def _append(self, op):
+        self._segment.write(json.dumps(op) + "\n")
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+
+    def _rotate(self):
+        old_id = self._segment_id
+        self._segment.close()
+        self._open_segment()
+        return old_id
+
+    def _close_segment(self):
+        self._segment.close()
+        if os.path.getsize(self._segment_path(self._segment_id)) == 0:
+            self._remove_segment(self._segment_id)
+
+    def _read_ops(self, batch_id):
+        ops = []
+        with open(self._segment_path(batch_id), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    ops.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"Skipping torn journal record in {batch_id}.jsonl")
+        return ops
+
+    def _read_segments(self):
+        segments = []
+        for name in sorted(os.listdir(self.journal_dir)):
+            if not name.endswith('.jsonl') or name[:-6] == self._segment_id:
+                continue
+            batch = _Batch()
+            with open(os.path.join(self.journal_dir, name), encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        batch.apply(json.loads(line))
+                    except (ValueError, KeyError):
+                        logger.warning(f"Skipping torn journal record in {name}")
+            segments.append((name[:-6], batch))
+        return segments
+
+    def _remove_segment(self, batch_id):
+        try:
+            os.remove(self._segment_path(batch_id))
+        except FileNotFoundError:
+            pass
+
+    def _dead_letter_path(self, batch_id):
+        return os.path.join(self.dead_letter_dir, f"{batch_id}.jsonl")
+
+    def _dead_letter(self, batch_id, ops):
+        os.makedirs(self.dead_letter_dir, exist_ok=True)
+        path = self._dead_letter_path(batch_id)
+        with open(path, 'a', encoding='utf-8') as f:
+            for op_id, op in ops:
+                f.write(json.dumps({'id': op_id, 'op': op}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return path
+
+    def _dead_letter_ids(self, batch_id):
+        try:
+            with open(self._dead_letter_path(batch_id), encoding='utf-8') as f:
+                return {json.loads(line)['id'] for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    async def _journal(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._journal_executor, func, *args)
+
+    # ---------- LIFECYCLE ----------
+    async def start(self):
+        """Replay journals left by a previous run, then start the flush timer"""
+        os.makedirs(self.journal_dir, exist_ok=True)
+        await self._journal(self._open_segment)
+        for batch_id, batch in await self._journal(self._read_segments):
+            applied = await self.db.prepared_query('select_batch_applied', (batch_id,))
+            if applied:
+                await self._journal(self._remove_segment, batch_id)
+            elif batch:
+                logger.info(f"Replaying {batch.ops} journaled writes from batch {batch_id}")
+                self._track_points(batch, 1)
+                # A batch that was being applied write by write carries on that way
+                split = await self.db.query(STATEMENTS['select_op_batches_applied'], (f"{batch_id}-%",))
+                self._failed.append((batch_id, batch, self.max_rejections if split else 0))
+            else:
+                await self._journal(self._remove_segment, batch_id)
+        await self.flush()
+        self._timer_task = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        """Stop the timer and flush whatever is still buffered"""
+        if self._timer_task is not None:
+            self._timer_task.cancel()
+        await self.flush()
+        if self._segment is not None:
+            await self._journal(self._close_segment)
+        self._journal_executor.shutdown(wait=True)
+
+    async def _flush_periodically(self):
+        pruned_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write buffer flush failed: {e}")
+            if time.monotonic() - pruned_at >= PRUNE_INTERVAL:
+                pruned_at = time.monotonic()
+                try:
+                    await self.prune_applied()
+                except Exception as e:
+                    logger.error(f"Pruning applied write batches failed: {e}")
+
+    async def prune_applied(self):
+        """Delete write_batches rows no journal segment of this process can be replayed against"""
+        oldest = min([self._segment_id] + [batch_id for batch_id, _, _ in self._failed])
+        deleted = await self.db.prepared_update('prune_batches_applied', (oldest, self.keep_applied_days))
+        if deleted:
+            logger.info(f"Pruned {deleted} applied write batch ids")
+        return deleted
+
+    # ---------- WRITES ----------
+    async def _record(self, op):
+        async with self._swap_lock:
+            await self._journal(self._append, op)
+            self.pending.apply(op)
+            if op['op'] == 'points':
+                self._unflushed[op['user_id']] = self._unflushed.get(op['user_id'], 0) + op['amount']
+        self.ops_buffered += 1
+        if self.pending.ops >= self.max_pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+
+    def _track_points(self, batch, sign):
+        for user_id, (delta, _, _) in batch.points.items():
+            total = self._unflushed.get(user_id, 0) + sign * delta
+            if total:
+                self._unflushed[user_id] = total
+            else:
+                self._unflushed.pop(user_id, None)
+
+    def unflushed_points(self, user_id):
+        """Points acknowledged for a user but not yet committed to MySQL"""
+        return self._unflushed.get(user_id, 0)
+
+    async def update_user(self, user_id, username, display_name=None):
+        """Buffer a username/display name change; display_name=None keeps the stored one"""
+        await self._record({'op': 'user', 'user_id': user_id,
+                            'username': username, 'display_name': display_name})
+
+    async def add_points(self, user_id, guild_id, amount, username, display_name):
+        """Buffer a points delta (creating the user row if needed) plus its activity entry"""
+        if not POINTS_MIN <= amount <= POINTS_MAX:
+            raise ValueError(f"Points delta {amount} is outside the INT column range")
+        await self._record({'op': 'points', 'user_id': user_id, 'guild_id': guild_id, 'amount': amount,
+                            'username': username, 'display_name': display_name, 'at': time.time()})
+
+    async def flush(self):
+        async with self._flush_lock:
+            async with self._swap_lock:
+                if self.pending:
+                    batch, self.pending = self.pending, _Batch()
+                    batch_id = await self._journal(self._rotate)
+                    self._failed.append((batch_id, batch, 0))
+
+            retry, self._failed = self._failed, []
+            for batch_id, batch, rejections in retry:
+                self.flush_version += 1
+                committed = None
+                if rejections < self.max_rejections:
+                    committed = await self._commit(batch_id, batch)
+                    rejections += committed is False
+                if committed:
+                    self._track_points(batch, -1)
+                elif rejections >= self.max_rejections:
+                    # Find the writes the database rejects and let the others through
+                    remaining = await self._flush_ops(batch_id)
+                    self._track_points(batch, -1)
+                    self._track_points(remaining, 1)
+                    batch = remaining
+                self.flush_version += 1
+                if committed:
+                    await self._journal(self._remove_segment, batch_id)
+                    self.flushes += 1
+                    self.rows_written += batch.rows()
+                elif rejections >= self.max_rejections and not batch:
+                    await self._journal(self._remove_segment, batch_id)
+                else:
+                    self._failed.append((batch_id, batch, rejections))
+            if self._failed:
+                logger.warning(f"{len(self._failed)} buffered batch(es) failed to flush; will retry")
+
+    async def _commit(self, batch_id, batch):
+        """True once committed, False if the database rejected it, None if it couldn't be reached"""
+        try:
+            return await self.db.transaction(batch.statements(batch_id))
+        except Exception as e:
+            logger.error(f"Flushing batch {batch_id} failed: {e}")
+            return None
+
+    async def _flush_ops(self, batch_id):
+        """Apply a rejected batch one journaled write at a time; returns the writes still unsettled.
+
+        Each write commits under the id '<batch_id>-<n>' and dead-lettered ones
+        are recorded under the same id, so a restart carries on where this
+        left off. Writes rejected on their own are dead-lettered; an outage
+        stops the pass and leaves the rest for the next flush.
+        """
+        ops = await self._journal(self._read_ops, batch_id)
+        applied = await self.db.query(STATEMENTS['select_op_batches_applied'], (f"{batch_id}-%",))
+        if applied is None:
+            return _batch_of(ops)
+        settled = {row['batch_id'] for row in applied} | await self._journal(self._dead_letter_ids, batch_id)
+        dead = []
+        for i, op in enumerate(ops):
+            op_id = f"{batch_id}-{i}"
+            if op_id in settled:
+                continue
+            single = _batch_of([op])
+            committed = await self._commit(op_id, single)
+            if committed is None:
+                await self._dead_letter_ops(batch_id, dead)
+                return _batch_of(ops[i:])
+            if committed:
+                self.rows_written += single.rows()
+            else:
+                dead.append((op_id, op))
+        self.flushes += 1
+        await self._dead_letter_ops(batch_id, dead)
+        return _Batch()
+
+    async def _dead_letter_ops(self, batch_id, ops):
+        """Set (op_id, op) writes aside in dead_letter/<batch_id>.jsonl"""
+        if not ops:
+            return
+        path = await self._journal(self._dead_letter, batch_id, ops)
+        self.dead_letters += len(ops)
+        logger.error(f"{len(ops)} write(s) from batch {batch_id} were rejected by the database; moved to {path}")
+        if self.on_dead_letter is not None:
+            for _, op in ops:
+                self.on_dead_letter(op)
+
+    def stats(self):
+        return {
+            'pending_ops': self.pending.ops,
+            'failed_batches': len(self._failed),
+            'ops_buffered': self.ops_buffered,
+            'rows_written': self.rows_written,
+            'flushes': self.flushes,
+            'dead_letters': self.dead_letters,
+        }